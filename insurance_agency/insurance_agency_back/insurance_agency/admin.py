@@ -118,7 +118,8 @@ class DealAdmin(admin.ModelAdmin):
     search_fields = ["insurance_name", "owner_full_name", "customer_full_name", "insurance_price"]
     list_filter = ["deal_type", "status"]
     list_per_page = 10
-    readonly_fields = ["id", "owner_full_name", "customer_full_name", "insurance_name", "insurance_price"]
+    readonly_fields = ["id", "owner_full_name", "customer_full_name", "insurance_name", "insurance_price",
+                       "created_at", "closed_at"]
 
     def owner_full_name(self, obj):
         return obj.owner.user.full_name
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class insuranceAgencyConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'insurance_agency'
+
+    def ready(self):
+        from . import signals
@@ -0,0 +1,126 @@
+import datetime
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+from decimal import Decimal
+from itertools import islice
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.utils import timezone
+
+from .models import UserProfile, Owner, Customer, Employee, RealtyType, Realty, Deal
+
+
+User = get_user_model()
+
+
+@contextmanager
+def benchmark_database(on_disk=False):
+    """
+    Runs the block against a throwaway test database, so that benchmarks
+    never touch (or get skewed by) the real data.
+
+    ``on_disk`` keeps an SQLite database in a file rather than in memory,
+    for benchmarks running several threads (each has its own connection).
+    """
+    old_name = connection.settings_dict["NAME"]
+    test_settings = connection.settings_dict["TEST"]
+    old_test_name = test_settings["NAME"]
+    with tempfile.TemporaryDirectory() as directory:
+        if on_disk and connection.vendor == "sqlite":
+            test_settings["NAME"] = os.path.join(directory, "benchmark.sqlite3")
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            yield
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            test_settings["NAME"] = old_test_name
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def measure(func, repeat=3):
+    """Returns the best wall time (seconds) of ``func`` and the queries it ran."""
+    best = None
+    for _ in range(repeat):
+        queries = QueryCounter()
+        with connection.execute_wrapper(queries):
+            started = time.perf_counter()
+            func()
+            elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, queries.count
+
+
+def _bulk_create(model, objects, batch_size):
+    created = []
+    objects = iter(objects)
+    while batch := list(islice(objects, batch_size)):
+        created.extend(model.objects.bulk_create(batch, batch_size=batch_size))
+    return created
+
+
+def _batched_insert(model, objects, batch_size):
+    # Same as _bulk_create, but doesn't keep millions of instances around
+    objects = iter(objects)
+    while batch := list(islice(objects, batch_size)):
+        model.objects.bulk_create(batch, batch_size=batch_size)
+
+
+def seed(deals_count, people=1000, realty_count=None, batch_size=5000):
+    """
+    Fills the database with ``deals_count`` deals and everything they need.
+
+    Goes through bulk_create, so model signals are not sent: rebuild any
+    derived data (``rebuild_stats``) before measuring code that reads it.
+    """
+    realty_count = realty_count or max(deals_count // 10, 1)
+
+    users = _bulk_create(User, (User(username=f"bench_user_{i}") for i in range(people)), batch_size)
+    profiles = _bulk_create(UserProfile, (
+        UserProfile(user=user,
+                    full_name=f"Bench User {i}",
+                    email=f"bench{i}@example.com",
+                    birth_day=datetime.date(1950 + i % 55, 1 + i % 12, 1 + i % 28),
+                    is_owner=i % 2 == 0,
+                    is_customer=i % 2 == 1)
+        for i, user in enumerate(users)), batch_size)
+
+    owners = _bulk_create(Owner, (Owner(user=profile) for profile in profiles[0::2]), batch_size)
+    customers = _bulk_create(Customer, (Customer(user=profile) for profile in profiles[1::2]), batch_size)
+    employees = _bulk_create(Employee, (Employee(user=profile) for profile in profiles[1::20]), batch_size)
+    types = _bulk_create(RealtyType, (RealtyType(name=f"Bench type {i}") for i in range(5)), batch_size)
+
+    realty_owners = [owners[i % len(owners)].pk for i in range(realty_count)]
+    realties = _bulk_create(Realty, (
+        Realty(type_id=types[i % len(types)].pk,
+               owner_id=realty_owners[i],
+               name=f"Bench realty {i}",
+               address=f"{i} Bench street",
+               price=Decimal(10000 + i % 1000 * 100),
+               area=Decimal("50.00"),
+               built_year=1950 + i % 70,
+               is_in_deal=True)
+        for i in range(realty_count)), batch_size)
+    realty_ids = [realty.pk for realty in realties]
+
+    deal_types = Deal.DealType.values
+    closed_at = timezone.now()
+    _batched_insert(Deal, (
+        Deal(deal_type=deal_types[i % len(deal_types)],
+             status=Deal.DealStatus.COMPLETED,
+             closed_at=closed_at,
+             realty_id=realty_ids[i % realty_count],
+             owner_id=realty_owners[i % realty_count],
+             customer_id=customers[i % len(customers)].pk,
+             employee_id=employees[i % len(employees)].pk if i % 7 else None)
+        for i in range(deals_count)), batch_size)
@@ -0,0 +1,122 @@
+"""
+Deal updates: optimistic concurrency control and status transitions.
+
+Every deal carries a version. An update only applies if the deal is still
+at the version its editor started from: one conditional UPDATE checks and
+bumps it, so of two employees editing the same deal the later one gets a
+DealConflict instead of silently overwriting the first. Nothing is locked
+while the form is open.
+
+Statuses only change along TRANSITIONS. ``transition`` moves any number of
+deals to a status in a single UPDATE, for the month-end closing, without
+reading them into Python.
+"""
+import logging
+from typing import NamedTuple
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import realty_cache, rollups, timeseries
+from .models import Deal, Realty
+
+
+logger = logging.getLogger(__name__)
+
+Status = Deal.DealStatus
+
+# status: statuses a deal in it can move to
+TRANSITIONS = {
+    Status.DRAFT: {Status.ACTIVE, Status.CANCELLED},
+    Status.ACTIVE: {Status.SUSPENDED, Status.COMPLETED, Status.CANCELLED},
+    Status.SUSPENDED: {Status.ACTIVE, Status.CANCELLED},
+    Status.COMPLETED: set(),
+    Status.CANCELLED: set(),
+}
+
+
+class DealConflict(Exception):
+    pass
+
+
+class TransitionResult(NamedTuple):
+    changed: int
+    # Already in the target status
+    unchanged: int
+    # {deal id: its status}
+    rejected: dict
+
+
+def can_transition(source, target):
+    return target == source or target in TRANSITIONS[source]
+
+
+def sources(target):
+    """Statuses a deal can move to ``target`` from."""
+    return [source for source, targets in TRANSITIONS.items() if target in targets]
+
+
+def release_realty(realty_ids):
+    """
+    Returns the realty with ``realty_ids`` (ids or a values() queryset) to the
+    catalog, unless it is still in an open deal.
+    """
+    # With one open deal per realty, the realty of a cancelled deal is free again
+    open_statuses = [status for status in Status if status not in Deal.CLOSED_STATUSES]
+    releasable = (Realty.objects
+                  .filter(pk__in=realty_ids, is_in_deal=True)
+                  .exclude(deal_realty__status__in=open_statuses))
+    # update() sends no signals
+    contributions = rollups.available_contributions(releasable)
+    released = list(releasable.values_list("pk", flat=True))
+    if not released:
+        return
+    releasable.update(is_in_deal=False)
+    rollups.apply({}, contributions)
+    realty_cache.invalidate(released)
+
+
+def save_if_unchanged(deal, expected_version):
+    """Saves ``deal`` if nobody changed it since ``expected_version``, raises DealConflict otherwise."""
+    with transaction.atomic():
+        swapped = Deal.objects.filter(pk=deal.pk, version=expected_version).update(version=F("version") + 1)
+        if not swapped:
+            logger.warning(f"Deal {deal.pk} changed since version {expected_version}")
+            raise DealConflict(f"Deal {deal.pk} was changed by someone else")
+        # Same transaction: no other writer gets in between
+        deal.save(version=expected_version + 1)
+        if deal.status == Status.CANCELLED:
+            release_realty([deal.realty_id])
+
+
+def transition(deals, target):
+    """
+    Moves ``deals`` (a queryset) to ``target`` in one UPDATE, and the realty
+    of cancelled deals back to the catalog in another. Deals that can't move
+    there (see TRANSITIONS) are left as they are and reported.
+    """
+    allowed = sources(target)
+    closed_at = timezone.now() if target in Deal.CLOSED_STATUSES else None
+    with transaction.atomic():
+        rejected = dict(deals.exclude(status__in=[*allowed, target]).order_by("pk").values_list("pk", "status"))
+        unchanged = deals.filter(status=target).count()
+        moving = deals.filter(status__in=allowed)
+        # update() sends no signals. Of the rollups only the time series
+        # depend on the status: move them for the whole group at once.
+        old = timeseries.deals_snapshot(moving)
+        changed = moving.update(status=target, closed_at=closed_at, version=F("version") + 1)
+
+        if changed:
+            if changed == sum(opened for opened, *_ in old.values()):
+                timeseries.apply(old, timeseries.moved(old, target, closed_at))
+            else:
+                # Deals changed in between: the snapshot is not what moved
+                logger.warning(f"Deals changed during a transition to {target}, rebuilding the time series")
+                timeseries.rebuild()
+            if target == Status.CANCELLED:
+                release_realty(Deal.objects.filter(status=target, closed_at=closed_at).values("realty"))
+            rollups.bump_version()
+
+    logger.info(f"{changed} deals moved to {target}, {unchanged} already there, {len(rejected)} rejected")
+    return TransitionResult(changed, unchanged, rejected)
@@ -0,0 +1,73 @@
+"""
+Streaming deal exports, as CSV or NDJSON.
+
+Rows are read with a chunked ``.iterator()`` and written out one at a time,
+so exporting the whole Deal table takes as little memory as a single page.
+Used by the ``deals-export`` view and the ``export_deals`` command.
+"""
+import csv
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import F
+
+
+FIELDS = ("id", "deal_type", "status", "created_at", "closed_at", "actual_end_date")
+NAMES = {
+    "realty_name": F("realty__name"),
+    "realty_price": F("realty__price"),
+    "owner_name": F("owner__user__full_name"),
+    "customer_name": F("customer__user__full_name"),
+    "employee_name": F("employee__user__full_name"),
+}
+COLUMNS = (*FIELDS, *NAMES)
+
+FORMATS = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+}
+
+CHUNK_SIZE = 2000
+
+
+def filter_deals(deals, status=None, deal_type=None, created_from=None, created_to=None):
+    """``created_from`` and ``created_to`` are inclusive dates."""
+    if status:
+        deals = deals.filter(status__in=status)
+    if deal_type:
+        deals = deals.filter(deal_type__in=deal_type)
+    return deals.created_between(created_from, created_to)
+
+
+def rows(deals):
+    return deals.order_by("id").values(*FIELDS, **NAMES).iterator(chunk_size=CHUNK_SIZE)
+
+
+def _value(value):
+    if value is None:
+        return ""
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return str(value)
+
+
+class _Echo:
+    # csv.writer only writes to file-like objects
+    def write(self, value):
+        return value
+
+
+def csv_lines(deals):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(COLUMNS)
+    for row in rows(deals):
+        yield writer.writerow([_value(row[column]) for column in COLUMNS])
+
+
+def ndjson_lines(deals):
+    for row in rows(deals):
+        yield json.dumps({column: row[column] for column in COLUMNS}, cls=DjangoJSONEncoder, ensure_ascii=False) + "\n"
+
+
+def lines(deals, export_format):
+    return csv_lines(deals) if export_format == "csv" else ndjson_lines(deals)
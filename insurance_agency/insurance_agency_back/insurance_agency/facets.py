@@ -0,0 +1,79 @@
+"""
+Faceted filtering of realty listings: [min, max) ranges on price, area and
+built year plus the realty type category, with counts for every bucket of
+the current result set computed in one aggregate query.
+"""
+from django.db.models import Count, Q
+
+from .models import RealtyType
+
+
+# Bucket bounds per range facet, the first and last buckets are open-ended
+RANGE_FACETS = {
+    "price": (50_000, 100_000, 250_000, 500_000, 1_000_000),
+    "area": (50, 100, 200),
+    "built_year": (1950, 1980, 2000, 2010),
+}
+
+
+def buckets(bounds):
+    edges = (None, *bounds, None)
+    return list(zip(edges, edges[1:]))
+
+
+def range_q(field, lower, upper):
+    q = Q()
+    if lower is not None:
+        q &= Q(**{f"{field}__gte": lower})
+    if upper is not None:
+        q &= Q(**{f"{field}__lt": upper})
+    return q
+
+
+def apply_filters(queryset, filters):
+    """Narrows ``queryset`` down with the cleaned data of a RealtyFilterForm."""
+    for field in RANGE_FACETS:
+        queryset = queryset.filter(range_q(field, filters.get(f"{field}_min"), filters.get(f"{field}_max")))
+    if filters.get("category"):
+        queryset = queryset.filter(type__category__in=filters["category"])
+    return queryset
+
+
+def facet_counts(queryset):
+    """Returns {facet: [bucket]} with the number of ``queryset`` rows in every bucket."""
+    aggregates = {}
+    for field, bounds in RANGE_FACETS.items():
+        for i, (lower, upper) in enumerate(buckets(bounds)):
+            aggregates[f"{field}_{i}"] = Count("id", filter=range_q(field, lower, upper))
+    for category in RealtyType.RealtyCategory.values:
+        aggregates[f"category_{category}"] = Count("id", filter=Q(type__category=category))
+    counts = queryset.order_by().aggregate(**aggregates)
+
+    facets = {
+        field: [{"min": lower, "max": upper, "count": counts[f"{field}_{i}"]}
+                for i, (lower, upper) in enumerate(buckets(bounds))]
+        for field, bounds in RANGE_FACETS.items()
+    }
+    facets["category"] = [{"value": value, "label": label, "count": counts[f"category_{value}"]}
+                          for value, label in RealtyType.RealtyCategory.choices]
+    return facets
+
+
+def _query(params, **values):
+    params = params.copy()
+    params.pop("cursor", None)
+    for key, value in values.items():
+        params.pop(key, None)
+        if value is not None:
+            params[key] = value
+    return params.urlencode()
+
+
+def add_links(facets, params):
+    """Adds the query string selecting each bucket to ``facets``, keeping the other ``params``."""
+    for field in RANGE_FACETS:
+        for bucket in facets[field]:
+            bucket["query"] = _query(params, **{f"{field}_min": bucket["min"], f"{field}_max": bucket["max"]})
+    for bucket in facets["category"]:
+        bucket["query"] = _query(params, category=bucket["value"])
+    return facets
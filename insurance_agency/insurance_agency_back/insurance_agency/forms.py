@@ -3,7 +3,9 @@ import datetime
 from django import forms
 from django.core.validators import MinValueValidator, MaxValueValidator
 
-from .models import Customer, Owner, Employee, Realty, Deal, UserProfile
+from .deals import TRANSITIONS
+from .exports import FORMATS
+from .models import Customer, Owner, Employee, Realty, Deal, UserProfile, RealtyType
 
 secrets = {
     "employee": "employee_secret_code",
@@ -128,10 +130,46 @@ class DealAdminForm(forms.ModelForm):
 
 
 class DealUpdateForm(forms.ModelForm):
+    # Version of the deal the form was filled in from
+    version = forms.IntegerField(widget=forms.HiddenInput, min_value=0)
+
     class Meta:
         model = Deal
         fields = ["status", "actual_end_date"]
         widgets = {
             "status": forms.Select(),
             "actual_end_date": forms.DateInput(attrs={'type': 'date'}),
-        }
\ No newline at end of file
+        }
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields["version"].initial = self.instance.version
+        # Only the statuses the deal can move to
+        status = self.instance.status
+        self.fields["status"].choices = [(value, label) for value, label in Deal.DealStatus.choices
+                                         if value == status or value in TRANSITIONS[status]]
+
+
+class DealTransitionForm(forms.Form):
+    deals = forms.ModelMultipleChoiceField(queryset=Deal.objects.all())
+    status = forms.ChoiceField(choices=Deal.DealStatus.choices)
+
+
+class DealExportForm(forms.Form):
+    format = forms.ChoiceField(required=False, choices=[(name, name) for name in FORMATS])
+    status = forms.MultipleChoiceField(required=False, choices=Deal.DealStatus.choices)
+    deal_type = forms.MultipleChoiceField(required=False, choices=Deal.DealType.choices)
+    # Creation dates, both included
+    created_from = forms.DateField(required=False)
+    created_to = forms.DateField(required=False)
+
+
+class RealtyFilterForm(forms.Form):
+    # Ranges include the minimum and exclude the maximum, like the facet buckets
+    price_min = forms.DecimalField(required=False, min_value=0)
+    price_max = forms.DecimalField(required=False, min_value=0)
+    area_min = forms.DecimalField(required=False, min_value=0)
+    area_max = forms.DecimalField(required=False, min_value=0)
+    built_year_min = forms.IntegerField(required=False, min_value=0)
+    built_year_max = forms.IntegerField(required=False, min_value=0)
+    category = forms.MultipleChoiceField(required=False, choices=RealtyType.RealtyCategory.choices)
@@ -0,0 +1,59 @@
+from itertools import chain
+
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+
+from insurance_agency.benchmarks import benchmark_database, measure, seed
+from insurance_agency.models import Customer, Deal, Owner, UserProfile
+from insurance_agency.pagination import paginate
+from insurance_agency.views import MY_DEALS_SORT, user_deals
+
+
+def chained(profile):
+    # What "my deals" used to do: one query per role, merged in Python
+    owner_deals = Deal.objects.none()
+    customer_deals = Deal.objects.none()
+    if profile.is_owner:
+        owner_deals = Deal.objects.for_listing().filter(owner=Owner.objects.get(user=profile))
+    if profile.is_customer:
+        customer_deals = Deal.objects.for_listing().filter(customer=Customer.objects.get(user=profile))
+    return list(chain(owner_deals, customer_deals))
+
+
+def pages(profile, count):
+    """Walks the first ``count`` pages of the deals of ``profile``."""
+    cursor = None
+    for _ in range(count):
+        page = paginate(user_deals(profile), MY_DEALS_SORT, cursor, counted=False)
+        cursor = page.next_cursor
+        if cursor is None:
+            break
+
+
+class Command(BaseCommand):
+    help = "Benchmarks the \"my deals\" page for users with thousands of deals on a throwaway database"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", nargs="+", type=int, default=[100_000, 1_000_000],
+                            help="Numbers of deals to benchmark with")
+        parser.add_argument("--people", type=int, default=200,
+                            help="Users sharing the deals, half of them owners and half customers")
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'deals':>10} {'user deals':>11} {'method':<14} {'seconds':>10} {'queries':>8}")
+        for size in options["sizes"]:
+            with benchmark_database():
+                seed(size, people=options["people"])
+                # The customer with the most deals
+                customer = (Customer.objects.annotate(deals=Count("deal_customer"))
+                            .order_by("-deals").values_list("user", "deals").first())
+                profile = UserProfile.objects.get(pk=customer[0])
+
+                methods = {
+                    "chain": lambda: chained(profile),
+                    "first_page": lambda: pages(profile, 1),
+                    "ten_pages": lambda: pages(profile, 10),
+                }
+                for name, method in methods.items():
+                    seconds, queries = measure(method)
+                    self.stdout.write(f"{size:>10} {customer[1]:>11} {name:<14} {seconds:>10.5f} {queries:>8}")
@@ -0,0 +1,105 @@
+import random
+import threading
+import time
+from collections import Counter
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError, OperationalError, connection, transaction
+from django.db.models import Count
+
+from insurance_agency import reservations, rollups
+from insurance_agency.benchmarks import benchmark_database, seed
+from insurance_agency.models import Customer, Deal, Realty
+
+
+def claim(realty, customer):
+    with transaction.atomic():
+        reservations.claim(realty.pk, customer)
+        Deal.objects.create(deal_type=Deal.DealType.SALE, realty=realty, customer=customer, owner_id=realty.owner_id)
+
+
+def read_then_write(realty, customer):
+    # What the deal view used to do: check, then save, outside of a transaction
+    realty = Realty.objects.get(pk=realty.pk)
+    if realty.is_in_deal:
+        raise reservations.RealtyUnavailable(f"Realty {realty.pk} is in a deal")
+    realty.is_in_deal = True
+    realty.save()
+    Deal.objects.create(deal_type=Deal.DealType.SALE, realty=realty, customer=customer, owner_id=realty.owner_id)
+
+
+STRATEGIES = {
+    "claim": claim,
+    "read_then_write": read_then_write,
+}
+
+
+class Command(BaseCommand):
+    help = "Races threads of customers for the same realty and reports double bookings and throughput"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threads", type=int, default=8)
+        parser.add_argument("--realty", type=int, default=20, help="Realty the threads compete for")
+        parser.add_argument("--strategies", nargs="+", choices=STRATEGIES, default=list(STRATEGIES))
+
+    def race(self, strategy, threads, realty_count):
+        with benchmark_database(on_disk=True):
+            seed(0, people=threads * 2, realty_count=realty_count)
+            Realty.objects.update(is_in_deal=False)
+            rollups.rebuild()
+            customers = list(Customer.objects.all()[:threads])
+            realties = list(Realty.objects.all())
+
+            outcomes = Counter()
+            lock = threading.Lock()
+            start = threading.Barrier(threads)
+
+            def customer_thread(customer):
+                # Every customer goes after every realty, in their own order
+                targets = random.sample(realties, len(realties))
+                start.wait()
+                try:
+                    for realty in targets:
+                        try:
+                            strategy(realty, customer)
+                            outcome = "deals"
+                        except reservations.RealtyUnavailable:
+                            outcome = "unavailable"
+                        except IntegrityError:
+                            outcome = "stopped_by_constraint"
+                        except OperationalError:
+                            outcome = "database_errors"
+                        with lock:
+                            outcomes[outcome] += 1
+                finally:
+                    connection.close()
+
+            workers = [threading.Thread(target=customer_thread, args=(customer,)) for customer in customers]
+            started = time.perf_counter()
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            seconds = time.perf_counter() - started
+
+            double_booked = (Deal.objects.values("realty").annotate(deals=Count("id"))
+                             .filter(deals__gt=1).count())
+            return outcomes, double_booked, seconds, rollups.drift()
+
+    def handle(self, *args, **options):
+        threads, realty_count = options["threads"], options["realty"]
+        attempts = threads * realty_count
+
+        self.stdout.write(f"{threads} customers racing for {realty_count} realty, {attempts} attempts")
+        self.stdout.write(f"{'strategy':<16} {'deals':>6} {'double':>7} {'refused':>8} {'constraint':>11} "
+                          f"{'db errors':>10} {'seconds':>9} {'attempts/s':>11}")
+        failed = []
+        for name in options["strategies"]:
+            outcomes, double_booked, seconds, drift = self.race(STRATEGIES[name], threads, realty_count)
+            self.stdout.write(f"{name:<16} {outcomes['deals']:>6} {double_booked:>7} {outcomes['unavailable']:>8} "
+                              f"{outcomes['stopped_by_constraint']:>11} {outcomes['database_errors']:>10} "
+                              f"{seconds:>9.3f} {attempts / seconds:>11.0f}")
+            if name == "claim" and (double_booked or outcomes["deals"] != realty_count or drift):
+                failed.append(name)
+        if failed:
+            raise CommandError(f"Double booking or lost reservations with: {', '.join(failed)}")
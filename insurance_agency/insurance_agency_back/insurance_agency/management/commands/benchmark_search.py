@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from insurance_agency import search
+from insurance_agency.benchmarks import benchmark_database, measure, seed
+from insurance_agency.models import Realty
+
+
+class Command(BaseCommand):
+    help = "Benchmarks realty full-text search against LIKE scans on a throwaway database"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", nargs="+", type=int, default=[10_000, 100_000, 1_000_000],
+                            help="Numbers of realty listings to benchmark with")
+        parser.add_argument("--query", default="4321",
+                            help="Search text; the default matches a handful of seeded listings")
+
+    def handle(self, *args, **options):
+        query = options["query"]
+        words = query.split()
+        legacy = Q()
+        for word in words:
+            legacy &= Q(name__icontains=word) | Q(address__icontains=word) | Q(type__name__icontains=word)
+
+        methods = {
+            "full_text": lambda: list(search.search(Realty.objects.all(), query).order_by("search_rank")[:20]),
+            "icontains": lambda: list(Realty.objects.filter(legacy).order_by("-id")[:20]),
+        }
+
+        self.stdout.write(f"{'listings':>10} {'method':<12} {'seconds':>10} {'matches':>8}")
+        for size in options["sizes"]:
+            with benchmark_database():
+                seed(0, realty_count=size)
+                search.rebuild()
+                matches = search.search(Realty.objects.all(), query).count()
+                for name, method in methods.items():
+                    seconds, _ = measure(method)
+                    self.stdout.write(f"{size:>10} {name:<12} {seconds:>10.5f} {matches:>8}")
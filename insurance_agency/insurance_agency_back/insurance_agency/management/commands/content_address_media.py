@@ -0,0 +1,45 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from django.db import models
+
+from insurance_agency_back.storage import ContentAddressedStorage, is_content_addressed
+
+
+class Command(BaseCommand):
+    help = "Moves media stored under uploaded filenames to content-addressed names"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--delete-originals", action="store_true",
+                            help="Delete the files under their old names once nothing refers to them")
+
+    def file_fields(self):
+        for model in apps.get_models():
+            for field in model._meta.get_fields():
+                if isinstance(field, models.FileField) and isinstance(field.storage, ContentAddressedStorage):
+                    yield model, field
+
+    def handle(self, *args, **options):
+        moved = missing = 0
+        for model, field in self.file_fields():
+            rows = model.objects.exclude(**{f"{field.name}__isnull": True}).exclude(**{field.name: ""})
+            for instance in rows.iterator():
+                field_file = getattr(instance, field.name)
+                old_name = field_file.name
+                if is_content_addressed(old_name):
+                    continue
+                if not field.storage.exists(old_name):
+                    missing += 1
+                    self.stderr.write(f"{model._meta.label} {instance.pk}: {old_name} does not exist")
+                    continue
+
+                with field.storage.open(old_name, "rb") as content:
+                    new_name = field.storage.save(old_name, content)
+                setattr(instance, field.name, new_name)
+                # Saved through the model, so caches and thumbnails follow
+                instance.save(update_fields=[field.name])
+                moved += 1
+
+                if options["delete_originals"] and not model.objects.filter(**{field.name: old_name}).exists():
+                    field.storage.delete(old_name)
+
+        self.stdout.write(self.style.SUCCESS(f"Moved {moved} files, {missing} missing"))
@@ -0,0 +1,31 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+
+from insurance_agency import exports
+from insurance_agency.models import Deal
+
+
+class Command(BaseCommand):
+    help = "Streams deals with their realty, owner, customer and employee names as CSV or NDJSON"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--format", choices=exports.FORMATS, default="csv")
+        parser.add_argument("--status", nargs="+", choices=Deal.DealStatus.values)
+        parser.add_argument("--type", dest="deal_type", nargs="+", choices=Deal.DealType.values)
+        parser.add_argument("--from", dest="created_from", type=datetime.date.fromisoformat,
+                            help="Deals created on or after this date (YYYY-MM-DD)")
+        parser.add_argument("--to", dest="created_to", type=datetime.date.fromisoformat,
+                            help="Deals created on or before this date (YYYY-MM-DD)")
+        parser.add_argument("--output", help="File to write to instead of the standard output")
+
+    def handle(self, *args, **options):
+        deals = exports.filter_deals(Deal.objects.all(), status=options["status"], deal_type=options["deal_type"],
+                                     created_from=options["created_from"], created_to=options["created_to"])
+        lines = exports.lines(deals, options["format"])
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8", newline="") as output:
+                output.writelines(lines)
+        else:
+            for line in lines:
+                self.stdout.write(line, ending="")
@@ -0,0 +1,24 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand
+
+from insurance_agency import thumbnails
+
+
+class Command(BaseCommand):
+    help = "Generates the missing thumbnails of existing realty and employee photos"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--force", action="store_true", help="Regenerate thumbnails that already exist")
+
+    def handle(self, *args, **options):
+        made = failed = 0
+        for (label, field), sizes in thumbnails.FIELD_SIZES.items():
+            model = apps.get_model(label)
+            for instance in model.objects.exclude(**{f"{field}__isnull": True}).exclude(**{field: ""}).iterator():
+                field_file = getattr(instance, field)
+                try:
+                    made += len(thumbnails.generate(field_file, sizes, force=options["force"]))
+                except Exception as error:
+                    failed += 1
+                    self.stderr.write(f"{label} {instance.pk}: {field_file.name}: {error}")
+        self.stdout.write(self.style.SUCCESS(f"Generated {made} thumbnails, {failed} photos failed"))
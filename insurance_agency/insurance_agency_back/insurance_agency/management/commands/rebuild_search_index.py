@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from insurance_agency import search
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the realty full-text search index from scratch"
+
+    def handle(self, *args, **options):
+        search.rebuild()
+        self.stdout.write(self.style.SUCCESS("Realty search index rebuilt"))
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from insurance_agency import rollups
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the statistics rollups from scratch or checks them for drift"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--check", action="store_true",
+                            help="Only report rollups that differ from the data, don't change anything")
+        parser.add_argument("--reconcile", action="store_true",
+                            help="Only rebuild when some rollups drifted; meant for a periodic job")
+
+    def handle(self, *args, **options):
+        if options["reconcile"]:
+            drifted = rollups.reconcile()
+            for name in sorted(drifted):
+                self.stdout.write(f"{name} drifted")
+            self.stdout.write(self.style.SUCCESS(
+                f"Rebuilt {len(drifted)} drifted statistics rollups" if drifted else "Statistics rollups are up to date"))
+            return
+
+        if not options["check"]:
+            rollups.rebuild()
+            self.stdout.write(self.style.SUCCESS("Statistics rollups rebuilt"))
+            return
+
+        drifted = rollups.drift()
+        for name, (stored, expected) in sorted(drifted.items()):
+            self.stdout.write(f"{name}: stored {stored}, expected {expected}")
+        if drifted:
+            raise CommandError(f"{len(drifted)} statistics rollups drifted, run rebuild_stats to fix them")
+        self.stdout.write(self.style.SUCCESS("Statistics rollups are up to date"))
@@ -0,0 +1,46 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from insurance_agency import deals
+from insurance_agency.models import Deal
+
+
+def date(value):
+    try:
+        return datetime.date.fromisoformat(value)
+    except ValueError:
+        raise CommandError(f"Not a YYYY-MM-DD date: {value}")
+
+
+class Command(BaseCommand):
+    help = "Moves deals to another status in bulk, e.g. to complete the active deals at month end"
+
+    def add_arguments(self, parser):
+        parser.add_argument("status", choices=Deal.DealStatus.values, help="Status to move the deals to")
+        selection = parser.add_mutually_exclusive_group(required=True)
+        selection.add_argument("--ids", nargs="+", type=int, help="Deals to move")
+        selection.add_argument("--from", dest="source", choices=Deal.DealStatus.values,
+                               help="Move every deal in this status")
+        parser.add_argument("--created-before", type=date,
+                            help="With --from, only the deals created before this date (YYYY-MM-DD)")
+
+    def handle(self, *args, **options):
+        target = options["status"]
+        if options["ids"]:
+            selected = Deal.objects.filter(pk__in=options["ids"])
+            for pk in sorted(set(options["ids"]) - set(selected.values_list("pk", flat=True))):
+                self.stderr.write(f"Deal {pk}: does not exist")
+        else:
+            source = options["source"]
+            if not deals.can_transition(source, target):
+                raise CommandError(f"{source} deals can't move to {target}")
+            selected = Deal.objects.filter(status=source)
+            if options["created_before"]:
+                selected = selected.created_between(last_day=options["created_before"] - datetime.timedelta(days=1))
+
+        result = deals.transition(selected, target)
+        for pk, status in result.rejected.items():
+            self.stderr.write(f"Deal {pk}: {status} can't move to {target}")
+        self.stdout.write(self.style.SUCCESS(f"Moved {result.changed} deals to {target}, "
+                                             f"{result.unchanged} already there, {len(result.rejected)} rejected"))
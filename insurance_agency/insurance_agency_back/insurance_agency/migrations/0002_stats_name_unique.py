@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('insurance_agency', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='stats',
+            name='name',
+            field=models.CharField(unique=True),
+        ),
+    ]
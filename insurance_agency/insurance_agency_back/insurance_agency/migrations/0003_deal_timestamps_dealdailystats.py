@@ -0,0 +1,50 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:03
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def close_finished_deals(apps, schema_editor):
+    # Nothing better is known about existing deals than the migration time
+    Deal = apps.get_model('insurance_agency', 'Deal')
+    Deal.objects.filter(status__in=['COMPLETED', 'CANCELLED']).update(closed_at=models.F('created_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('insurance_agency', '0002_stats_name_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='deal',
+            name='closed_at',
+            field=models.DateTimeField(blank=True, editable=False, help_text='Дата завершения или отмены сделки', null=True, verbose_name='Closed at'),
+        ),
+        migrations.AddField(
+            model_name='deal',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, db_index=True, default=django.utils.timezone.now, help_text='Дата создания сделки', verbose_name='Created at'),
+            preserve_default=False,
+        ),
+        migrations.RunPython(close_finished_deals, migrations.RunPython.noop),
+        migrations.CreateModel(
+            name='DealDailyStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('deal_type', models.CharField(choices=[('SALE', 'Продажа'), ('RENT', 'Аренда'), ('EXCHANGE', 'Обмен')], max_length=10)),
+                ('status', models.CharField(choices=[('DRAFT', 'Черновик'), ('ACTIVE', 'В процессе'), ('COMPLETED', 'Завершена'), ('CANCELLED', 'Отменена'), ('SUSPENDED', 'Приостановлена')], max_length=10)),
+                ('opened', models.IntegerField(default=0)),
+                ('opened_value', models.DecimalField(decimal_places=2, default=0, max_digits=18)),
+                ('closed', models.IntegerField(default=0)),
+                ('closed_value', models.DecimalField(decimal_places=2, default=0, max_digits=18)),
+            ],
+            options={
+                'verbose_name': 'Deal daily stats',
+                'verbose_name_plural': 'Deal daily stats',
+                'constraints': [models.UniqueConstraint(fields=('day', 'deal_type', 'status'), name='unique_deal_daily_stats')],
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+from django.db import migrations
+
+
+# Full-text search is SQLite only, see insurance_agency/search.py
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        "CREATE VIRTUAL TABLE insurance_agency_realty_search USING fts5("
+        "name, address, type_name, tokenize = 'unicode61 remove_diacritics 2')"
+    )
+    schema_editor.execute(
+        "INSERT INTO insurance_agency_realty_search (rowid, name, address, type_name) "
+        "SELECT realty.id, realty.name, realty.address, realty_type.name "
+        "FROM insurance_agency_realty realty "
+        "JOIN insurance_agency_realtytype realty_type ON realty_type.id = realty.type_id"
+    )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute("DROP TABLE IF EXISTS insurance_agency_realty_search")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('insurance_agency', '0003_deal_timestamps_dealdailystats'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
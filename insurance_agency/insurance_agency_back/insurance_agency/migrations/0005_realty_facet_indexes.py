@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('insurance_agency', '0004_realty_search'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='realty',
+            index=models.Index(fields=['price', 'id'], condition=models.Q(('is_in_deal', False)), name='realty_available_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='realty',
+            index=models.Index(fields=['area'], condition=models.Q(('is_in_deal', False)), name='realty_available_area_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='realty',
+            index=models.Index(fields=['built_year'], condition=models.Q(('is_in_deal', False)), name='realty_available_year_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='realty',
+            index=models.Index(fields=['type'], condition=models.Q(('is_in_deal', False)), name='realty_available_type_idx'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('insurance_agency', '0005_realty_facet_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='realty',
+            name='realty_available_area_idx',
+        ),
+        migrations.AddIndex(
+            model_name='realty',
+            index=models.Index(condition=models.Q(('is_in_deal', False)), fields=['area', 'id'], name='realty_available_area_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='realty',
+            index=models.Index(fields=['owner', 'price', 'id'], name='realty_owner_price_idx'),
+        ),
+    ]
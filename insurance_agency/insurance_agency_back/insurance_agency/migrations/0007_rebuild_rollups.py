@@ -0,0 +1,19 @@
+from django.db import migrations
+
+
+def drop_rollups_marker(apps, schema_editor):
+    # Rollups built before the available realty counters existed lack them;
+    # without the marker they are rebuilt on the next read.
+    Stats = apps.get_model('insurance_agency', 'Stats')
+    Stats.objects.filter(name='rollups:built').delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('insurance_agency', '0006_realty_sort_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_rollups_marker, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:35
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('insurance_agency', '0007_rebuild_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='realty',
+            name='reserved_by',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='reservations', to='insurance_agency.customer'),
+        ),
+        migrations.AddField(
+            model_name='realty',
+            name='reserved_until',
+            field=models.DateTimeField(blank=True, editable=False, help_text='Окончание резерва под сделку', null=True, verbose_name='Reserved until'),
+        ),
+        migrations.AddConstraint(
+            model_name='deal',
+            constraint=models.UniqueConstraint(condition=models.Q(('status__in', ['COMPLETED', 'CANCELLED']), _negated=True), fields=('realty',), name='unique_open_deal_per_realty'),
+        ),
+    ]
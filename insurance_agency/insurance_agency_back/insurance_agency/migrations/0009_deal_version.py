@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('insurance_agency', '0008_realty_reservation_open_deal_constraint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='deal',
+            name='version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -5,11 +5,61 @@ import pytz
 from django.conf import settings
 from django.core.validators import MinValueValidator, MaxValueValidator, MinLengthValidator, RegexValidator
 from django.db import models
+from django.utils import timezone
 
 
 phone_num_validator = RegexValidator(r"^\+375(:?33|29|25|44)\d{7}$")
 
 
+class ListingQuerySet(models.QuerySet):
+    # Relations the list templates read for every row
+    listing_related = ()
+
+    def for_listing(self):
+        """Fetches the rows together with everything their list page shows."""
+        # select_related() without fields would follow every foreign key
+        if not self.listing_related:
+            return self
+        return self.select_related(*self.listing_related)
+
+
+def _start_of(day):
+    return timezone.make_aware(datetime.datetime.combine(day, datetime.time.min))
+
+
+class EmployeeQuerySet(ListingQuerySet):
+    listing_related = ("user", "work_type")
+
+
+class CustomerQuerySet(ListingQuerySet):
+    listing_related = ("user",)
+
+
+class RealtyQuerySet(ListingQuerySet):
+    listing_related = ("owner__user",)
+
+    def for_detail(self):
+        """Fetches the rows together with everything the detail page shows."""
+        return self.select_related("type", "owner__user")
+
+
+class DealQuerySet(ListingQuerySet):
+    listing_related = ("realty", "customer__user", "owner__user", "employee__user")
+
+    def created_between(self, first_day=None, last_day=None):
+        """
+        Deals created from ``first_day`` to ``last_day`` included, in the
+        current time zone. Compares created_at itself with the bounds of the
+        days, so that its index is used, unlike ``created_at__date``.
+        """
+        deals = self
+        if first_day:
+            deals = deals.filter(created_at__gte=_start_of(first_day))
+        if last_day:
+            deals = deals.filter(created_at__lt=_start_of(last_day + datetime.timedelta(days=1)))
+        return deals
+
+
 class TypeOfWork(models.Model):
     name = models.CharField(
         blank=False,
@@ -96,6 +146,8 @@ class Employee(models.Model):
     )
     user = models.OneToOneField("UserProfile", on_delete=models.CASCADE)
 
+    objects = EmployeeQuerySet.as_manager()
+
     def __str__(self):
         return (f"Name: {self.user.full_name}\n"
                 f"Work experience: {self.work_experience}")
@@ -141,6 +193,8 @@ class Customer(models.Model):
     )
     user = models.OneToOneField("UserProfile", on_delete=models.CASCADE)
 
+    objects = CustomerQuerySet.as_manager()
+
     def __str__(self):
         return f"Customer {self.user.full_name} with {self.budget}$"
 
@@ -215,10 +269,43 @@ class Realty(models.Model):
         null=False,
         default=False
     )
+    # Held while the customer fills in the deal form, see reservations.py
+    reserved_by = models.ForeignKey(
+        "Customer",
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        editable=False,
+        related_name="reservations",
+    )
+    reserved_until = models.DateTimeField(
+        null=True,
+        blank=True,
+        editable=False,
+        verbose_name="Reserved until",
+        help_text="Окончание резерва под сделку"
+    )
+
+    objects = RealtyQuerySet.as_manager()
 
     class Meta:
         verbose_name="Realty"
         verbose_name_plural= "Realty"
+        # The catalog only ever shows realty that is not in a deal. Partial
+        # rather than leading is_in_deal indexes: SQLite compiles the filter
+        # to "NOT is_in_deal", which can't seek on an index column.
+        indexes = [
+            models.Index(fields=["price", "id"], name="realty_available_price_idx",
+                         condition=models.Q(is_in_deal=False)),
+            models.Index(fields=["area", "id"], name="realty_available_area_idx",
+                         condition=models.Q(is_in_deal=False)),
+            models.Index(fields=["built_year"], name="realty_available_year_idx",
+                         condition=models.Q(is_in_deal=False)),
+            models.Index(fields=["type"], name="realty_available_type_idx",
+                         condition=models.Q(is_in_deal=False)),
+            # "My realty" sorted by price
+            models.Index(fields=["owner", "price", "id"], name="realty_owner_price_idx"),
+        ]
 
     def __str__(self):
         return f"{self.name} for {self.price}"
@@ -237,6 +324,8 @@ class Deal(models.Model):
         CANCELLED = "CANCELLED", "Отменена"
         SUSPENDED = "SUSPENDED", "Приостановлена"
 
+    CLOSED_STATUSES = (DealStatus.COMPLETED, DealStatus.CANCELLED)
+
     deal_type = models.CharField(
         max_length=10,
         choices=DealType.choices,
@@ -273,6 +362,56 @@ class Deal(models.Model):
         verbose_name="End of payment",
         help_text="Фактическая дата завершения платежей"
     )
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        db_index=True,
+        verbose_name="Created at",
+        help_text="Дата создания сделки"
+    )
+    closed_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        editable=False,
+        verbose_name="Closed at",
+        help_text="Дата завершения или отмены сделки"
+    )
+    # Bumped by every update, see save() and deals.py
+    version = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+    )
+
+    objects = DealQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            # Status not in CLOSED_STATUSES
+            models.UniqueConstraint(fields=["realty"], condition=~models.Q(status__in=["COMPLETED", "CANCELLED"]),
+                                    name="unique_open_deal_per_realty"),
+        ]
+
+    def save(self, *args, version=None, **kwargs):
+        """
+        Every update of a saved deal bumps its version, so edit forms opened
+        before it get a conflict. ``version`` is the one deals.save_if_unchanged
+        already swapped in.
+        """
+        if self.status in self.CLOSED_STATUSES:
+            self.closed_at = self.closed_at or timezone.now()
+        else:
+            self.closed_at = None
+        bumped = version is None and not self._state.adding
+        if version is not None:
+            self.version = version
+        elif bumped:
+            self.version = models.F("version") + 1
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None:
+            kwargs["update_fields"] = {*update_fields, "version",
+                                       *(["closed_at"] if "status" in update_fields else [])}
+        super().save(*args, **kwargs)
+        if bumped:
+            self.refresh_from_db(fields=["version"])
 
     def __str__(self):
         return (f"Deal between {self.owner.user.full_name} "
@@ -288,7 +427,31 @@ class Stats(models.Model):
         help_text="Статистический график",
         upload_to='statistics/'
     )
-    name = models.CharField(null=False, blank=False)
+    name = models.CharField(null=False, blank=False, unique=True)
     main_number = models.FloatField(null=False, blank=False, default=0)
     number2 = models.FloatField(null=True, default=0)
-    number3 = models.FloatField(null=True, default=0)
\ No newline at end of file
+    number3 = models.FloatField(null=True, default=0)
+
+
+class DealDailyStats(models.Model):
+    """
+    Daily deal rollup. "opened" counts deals created on ``day`` that are now
+    in ``status``, "closed" counts deals completed or cancelled on ``day``.
+    """
+    day = models.DateField()
+    deal_type = models.CharField(max_length=10, choices=Deal.DealType.choices)
+    status = models.CharField(max_length=10, choices=Deal.DealStatus.choices)
+    opened = models.IntegerField(default=0)
+    opened_value = models.DecimalField(max_digits=18, decimal_places=2, default=0)
+    closed = models.IntegerField(default=0)
+    closed_value = models.DecimalField(max_digits=18, decimal_places=2, default=0)
+
+    class Meta:
+        verbose_name = "Deal daily stats"
+        verbose_name_plural = "Deal daily stats"
+        constraints = [
+            models.UniqueConstraint(fields=["day", "deal_type", "status"], name="unique_deal_daily_stats"),
+        ]
+
+    def __str__(self):
+        return f"{self.day} {self.deal_type} {self.status}: {self.opened} opened, {self.closed} closed"
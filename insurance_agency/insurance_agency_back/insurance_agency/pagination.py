@@ -0,0 +1,76 @@
+"""
+Keyset pagination: a page is whatever follows the (sort value, id) pair of
+the last row shown, so fetching page N costs the same as page 1 and rows
+don't shift between pages when listings are added or taken.
+"""
+import base64
+import json
+from typing import NamedTuple
+
+from django.conf import settings
+from django.core.exceptions import BadRequest, ValidationError
+from django.db.models import Q
+
+
+class KeysetPage(NamedTuple):
+    items: list
+    count: int
+    next_cursor: str | None
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except ValueError:
+        raise BadRequest(f"Invalid page cursor '{cursor}'")
+    if not isinstance(values, list) or len(values) != 2:
+        raise BadRequest(f"Invalid page cursor '{cursor}'")
+    return values
+
+
+def _sort_field(queryset, name):
+    if name in queryset.query.annotations:
+        return queryset.query.annotations[name].output_field
+    return queryset.model._meta.get_field(name)
+
+
+def paginate(queryset, sort_by, cursor=None, page_size=None, count=None, counted=True):
+    """
+    Returns the page of ``queryset`` ordered by ``sort_by`` (a field or
+    annotation name, optionally prefixed with "-") that starts after
+    ``cursor``. Ties are broken by id in the same direction, so the order
+    is total. ``count`` spares the COUNT query when the total is known,
+    ``counted=False`` when the page doesn't show it (the count is None then).
+    """
+    page_size = page_size or settings.LISTING_PAGE_SIZE
+    descending = sort_by.startswith("-")
+    field = sort_by.lstrip("-")
+    direction = "-" if descending else ""
+    queryset = queryset.order_by(*dict.fromkeys([direction + field, direction + "id"]))
+    if count is None and counted:
+        count = queryset.count()
+
+    if cursor:
+        value, pk = decode_cursor(cursor)
+        try:
+            value = _sort_field(queryset, field).to_python(value)
+            pk = queryset.model._meta.pk.to_python(pk)
+        except ValidationError:
+            raise BadRequest(f"Invalid page cursor '{cursor}'")
+        after = "lt" if descending else "gt"
+        keyset = Q(**{f"{field}__{after}": value})
+        if field != "id":
+            keyset |= Q(**{field: value, f"id__{after}": pk})
+        queryset = queryset.filter(keyset)
+
+    items = list(queryset[:page_size + 1])
+    next_cursor = None
+    if len(items) > page_size:
+        items = items[:page_size]
+        last = items[-1]
+        next_cursor = encode_cursor([str(getattr(last, field)), last.pk])
+    return KeysetPage(items, count, next_cursor)
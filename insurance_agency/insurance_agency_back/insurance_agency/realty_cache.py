@@ -0,0 +1,35 @@
+"""
+Cached realty detail pages: the realty itself (with its type and owner) and
+its rendered block, the "realty_detail" template fragment. Both are dropped
+whenever anything they show changes, see signals.py.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.core.cache.utils import make_template_fragment_key
+from django.http import Http404
+
+from .models import Realty
+
+
+FRAGMENT = "realty_detail"
+
+
+def realty_key(pk):
+    return f"realty:{pk}"
+
+
+def get_realty(pk):
+    realty = cache.get(realty_key(pk))
+    if realty is None:
+        realty = Realty.objects.for_detail().filter(pk=pk).first()
+        if realty is None:
+            raise Http404(f"There is no realty {pk}")
+        cache.set(realty_key(pk), realty, settings.REALTY_CACHE_TTL)
+    return realty
+
+
+def invalidate(pks):
+    keys = []
+    for pk in pks:
+        keys += [realty_key(pk), make_template_fragment_key(FRAGMENT, [pk])]
+    cache.delete_many(keys)
@@ -0,0 +1,65 @@
+"""
+Realty reservations.
+
+Opening the deal form reserves the realty for the customer for
+REALTY_RESERVATION_TTL seconds, and making the deal claims it. Both are a
+single conditional UPDATE, so of any number of customers racing for the
+same realty exactly one wins, without holding row locks (which SQLite
+doesn't have) while the form is filled in. Abandoned reservations expire.
+"""
+import datetime
+import logging
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from . import realty_cache, rollups
+from .models import Realty
+
+
+logger = logging.getLogger(__name__)
+
+
+class RealtyUnavailable(Exception):
+    pass
+
+
+def _claimable(customer, now):
+    free = Q(reserved_until__isnull=True) | Q(reserved_until__lte=now)
+    if customer is not None:
+        free |= Q(reserved_by=customer)
+    return Q(is_in_deal=False) & free
+
+
+def reserve(realty_pk, customer, ttl=None):
+    """
+    Reserves the realty for ``customer`` (or extends their reservation).
+    Returns False when it is in a deal or reserved by someone else.
+    """
+    ttl = settings.REALTY_RESERVATION_TTL if ttl is None else ttl
+    now = timezone.now()
+    reserved = (Realty.objects.filter(_claimable(customer, now), pk=realty_pk)
+                .update(reserved_by=customer, reserved_until=now + datetime.timedelta(seconds=ttl)))
+    if not reserved:
+        logger.info(f"Realty {realty_pk} is not available for {customer}")
+    return bool(reserved)
+
+
+def claim(realty_pk, customer):
+    """
+    Takes the realty off the catalog for a deal of ``customer``, unless
+    it is in a deal or reserved by someone else: raises RealtyUnavailable
+    then. Call it in the transaction creating the deal.
+    """
+    claimed = (Realty.objects.filter(_claimable(customer, timezone.now()), pk=realty_pk)
+               .update(is_in_deal=True, reserved_by=None, reserved_until=None))
+    if not claimed:
+        raise RealtyUnavailable(f"Realty {realty_pk} is in a deal or reserved by another customer")
+
+    # update() sends no signals: account for the realty leaving the catalog here
+    realty = rollups.realty_snapshot(realty_pk)
+    rollups.apply(rollups.realty_contributions({**realty, "is_in_deal": False}),
+                  rollups.realty_contributions(realty))
+    rollups.bump_version()
+    realty_cache.invalidate([realty_pk])
@@ -0,0 +1,322 @@
+"""
+Statistics rollups kept in the Stats table.
+
+Every tracked object adds a "contribution" to some rollup rows. Signal
+handlers (see signals.py) snapshot the contribution of an object before and
+after it changes and apply the difference with F() updates, so reading the
+statistics costs one query no matter how many deals there are.
+
+Rollup rows:
+    deals_total_value           main_number - value of all deals, number2 - deals count
+    deals_per_employee:<id>     main_number - deals handled by the employee
+    realty_per_type:<id>        main_number - realty of the type
+    age:<role>                  main_number - people with the role, number2 - sum of their birth years
+    available_realty            main_number - realty not in a deal
+    available_realty:<type id>  main_number - realty of the type not in a deal
+
+The "data_version" row is not a rollup: it is bumped whenever anything the
+statistics are computed from changes, and serves as a cheap ETag.
+"""
+import datetime
+import logging
+import math
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import F, Sum, Count
+from django.db.models.functions import ExtractYear
+
+from . import timeseries
+from .models import Stats, Deal, Realty, Customer, Employee, Owner, RealtyType, UserProfile
+
+
+logger = logging.getLogger(__name__)
+
+ROLLUPS_MARKER = "rollups:built"
+DATA_VERSION = "data_version"
+DEALS_TOTAL_VALUE = "deals_total_value"
+DEALS_PER_EMPLOYEE = "deals_per_employee:"
+REALTY_PER_TYPE = "realty_per_type:"
+AGE = "age:"
+AVAILABLE_REALTY = "available_realty"
+AVAILABLE_PER_TYPE = "available_realty:"
+
+ROLES = {
+    "customer": Customer,
+    "employee": Employee,
+    "owner": Owner,
+}
+
+# AVAILABLE_REALTY also covers AVAILABLE_PER_TYPE
+ROLLUP_PREFIXES = (ROLLUPS_MARKER, DEALS_TOTAL_VALUE, DEALS_PER_EMPLOYEE, REALTY_PER_TYPE, AGE, AVAILABLE_REALTY)
+
+
+def role_of(model):
+    for role, role_model in ROLES.items():
+        if role_model is model:
+            return role
+    return None
+
+
+# Contributions: {rollup name: (main_number delta, number2 delta)}
+
+def deal_contributions(deal):
+    if deal is None:
+        return {}
+    contributions = {DEALS_TOTAL_VALUE: (float(deal["price"]), 1)}
+    if deal["employee_id"]:
+        contributions[DEALS_PER_EMPLOYEE + str(deal["employee_id"])] = (1, 0)
+    return contributions
+
+
+def realty_contributions(realty):
+    if realty is None:
+        return {}
+    # Deals store the price of their realty, so a price change moves the
+    # value of every deal made on it.
+    contributions = {
+        REALTY_PER_TYPE + str(realty["type_id"]): (1, 0),
+        DEALS_TOTAL_VALUE: (float(realty["price"]) * realty["deals_count"], 0),
+    }
+    if not realty["is_in_deal"]:
+        contributions[AVAILABLE_REALTY] = (1, 0)
+        contributions[AVAILABLE_PER_TYPE + str(realty["type_id"])] = (1, 0)
+    return contributions
+
+
+def available_contributions(realty):
+    """What the ``realty`` queryset adds to the available counters when none of it is in a deal."""
+    contributions = {AVAILABLE_REALTY: (0, 0)}
+    for type_id, count in realty.order_by().values_list("type").annotate(Count("id")):
+        contributions[AVAILABLE_PER_TYPE + str(type_id)] = (count, 0)
+        contributions[AVAILABLE_REALTY] = (contributions[AVAILABLE_REALTY][0] + count, 0)
+    return contributions
+
+
+def role_contributions(role, person):
+    if person is None or person["birth_day"] is None:
+        return {}
+    return {AGE + role: (1, person["birth_day"].year)}
+
+
+def profile_contributions(profile):
+    # Only moves the birth years: the people counts belong to the role objects
+    if profile is None:
+        return {}
+    return {AGE + role: (0, profile["birth_day"].year) for role in profile["roles"]}
+
+
+# Snapshots of the state contributions are computed from
+
+def deal_snapshot(pk):
+    return (Deal.objects.filter(pk=pk)
+            .values("employee_id", price=F("realty__price"))
+            .first())
+
+
+def realty_snapshot(pk):
+    realty = Realty.objects.filter(pk=pk).values("type_id", "price", "is_in_deal").first()
+    if realty is not None:
+        realty["deals_count"] = Deal.objects.filter(realty_id=pk).count()
+    return realty
+
+
+def role_snapshot(model, pk):
+    return model.objects.filter(pk=pk).values(birth_day=F("user__birth_day")).first()
+
+
+def profile_snapshot(pk):
+    birth_day = UserProfile.objects.filter(pk=pk).values_list("birth_day", flat=True).first()
+    if birth_day is None:
+        return None
+    roles = [role for role, model in ROLES.items() if model.objects.filter(user_id=pk).exists()]
+    return {"birth_day": birth_day, "roles": roles}
+
+
+def _add(name, main_number, number2):
+    updated = Stats.objects.filter(name=name).update(main_number=F("main_number") + main_number,
+                                                     number2=F("number2") + number2)
+    if not updated:
+        _, created = Stats.objects.get_or_create(name=name, defaults={"main_number": main_number,
+                                                                      "number2": number2})
+        if not created:
+            _add(name, main_number, number2)
+
+
+def bump_version():
+    _add(DATA_VERSION, 1, 0)
+
+
+def version():
+    """Number of data changes seen so far, 0 before the first one."""
+    return int(Stats.objects.filter(name=DATA_VERSION).values_list("main_number", flat=True).first() or 0)
+
+
+def apply(old, new):
+    """Moves the rollups from the ``old`` contributions to the ``new`` ones."""
+    deltas = defaultdict(lambda: [0, 0])
+    for sign, contributions in ((-1, old), (1, new)):
+        for name, (main_number, number2) in contributions.items():
+            deltas[name][0] += sign * main_number
+            deltas[name][1] += sign * number2
+
+    for name, (main_number, number2) in deltas.items():
+        if main_number or number2:
+            _add(name, main_number, number2)
+
+
+def compute():
+    """Computes every rollup from scratch, in a constant number of queries."""
+    rollups = {ROLLUPS_MARKER: (1, 0)}
+
+    deals = Deal.objects.aggregate(total=Sum("realty__price"), count=Count("id"))
+    rollups[DEALS_TOTAL_VALUE] = (float(deals["total"] or 0), deals["count"])
+
+    for employee_id, deals_count in (Deal.objects.filter(employee__isnull=False).order_by()
+                                     .values_list("employee").annotate(Count("id"))):
+        rollups[DEALS_PER_EMPLOYEE + str(employee_id)] = (deals_count, 0)
+
+    for type_id, realty_count in Realty.objects.order_by().values_list("type").annotate(Count("id")):
+        rollups[REALTY_PER_TYPE + str(type_id)] = (realty_count, 0)
+
+    rollups[AVAILABLE_REALTY] = (0, 0)
+    for type_id, available in (Realty.objects.exclude(is_in_deal=True).order_by()
+                               .values_list("type").annotate(Count("id"))):
+        rollups[AVAILABLE_PER_TYPE + str(type_id)] = (available, 0)
+        rollups[AVAILABLE_REALTY] = (rollups[AVAILABLE_REALTY][0] + available, 0)
+
+    for role, model in ROLES.items():
+        people = model.objects.filter(user__isnull=False).aggregate(
+            count=Count("id"), birth_years=Sum(ExtractYear("user__birth_day")))
+        rollups[AGE + role] = (people["count"], people["birth_years"] or 0)
+    return rollups
+
+
+def _rollup_rows():
+    rows = Stats.objects.none()
+    for prefix in ROLLUP_PREFIXES:
+        rows = rows | Stats.objects.filter(name__startswith=prefix)
+    return rows
+
+
+def rebuild():
+    """Rebuilds the Stats rollups and the deal time series."""
+    with transaction.atomic():
+        _rollup_rows().delete()
+        timeseries.rebuild()
+        Stats.objects.bulk_create(
+            Stats(name=name, main_number=main_number, number2=number2)
+            for name, (main_number, number2) in compute().items()
+        )
+        bump_version()
+    logger.info("Statistics rollups rebuilt")
+
+
+def ensure_built():
+    if not Stats.objects.filter(name=ROLLUPS_MARKER).exists():
+        rebuild()
+
+
+def reconcile():
+    """
+    Rebuilds the rollups if any of them drifted from the data and returns
+    the drifted names. Meant to run periodically ("rebuild_stats --reconcile").
+    """
+    drifted = drift()
+    if drifted:
+        logger.warning(f"{len(drifted)} statistics rollups drifted, rebuilding: {', '.join(sorted(drifted))}")
+        rebuild()
+    return drifted
+
+
+def _close(stored, expected):
+    # Money rollups are floats summed by many F() updates: rounding errors
+    # grow with their value, but stay well under a cent
+    return math.isclose(stored, expected, rel_tol=1e-9, abs_tol=0.005)
+
+
+def drift():
+    """
+    Returns {rollup name: (stored, expected)} for every rollup, including
+    the deal time series, that is off.
+    """
+    expected = compute()
+    stored = {stats.name: (stats.main_number, stats.number2 or 0) for stats in _rollup_rows()}
+
+    drifted = {}
+    for name in expected.keys() | stored.keys():
+        stored_value = stored.get(name, (0, 0))
+        expected_value = expected.get(name, (0, 0))
+        if not all(_close(a, b) for a, b in zip(stored_value, expected_value)):
+            drifted[name] = (stored_value, expected_value)
+    drifted.update(timeseries.drift())
+    return drifted
+
+
+# Reading
+
+def read():
+    """Returns all rollup rows by name, building them on first use."""
+    rollups = {stats.name: stats for stats in _rollup_rows()}
+    if ROLLUPS_MARKER not in rollups:
+        rebuild()
+        rollups = {stats.name: stats for stats in _rollup_rows()}
+    return rollups
+
+
+def deals_total_value(rollups):
+    stats = rollups.get(DEALS_TOTAL_VALUE)
+    value = stats.main_number if stats else 0
+    return Decimal(value).quantize(Decimal("0.01"))
+
+
+def _counts(rollups, prefix):
+    return {int(name[len(prefix):]): int(stats.main_number)
+            for name, stats in rollups.items()
+            if name.startswith(prefix) and stats.main_number > 0}
+
+
+def deals_per_employee(rollups):
+    counts = _counts(rollups, DEALS_PER_EMPLOYEE)
+    names = dict(Employee.objects.filter(id__in=counts).values_list("id", "user__full_name"))
+    return [(names[employee_id], counts[employee_id]) for employee_id in sorted(counts) if employee_id in names]
+
+
+def _per_type(rollups, prefix):
+    counts = _counts(rollups, prefix)
+    names = dict(RealtyType.objects.filter(id__in=counts).values_list("id", "name"))
+    return [(names[type_id], counts[type_id]) for type_id in sorted(counts) if type_id in names]
+
+
+def realty_per_type(rollups):
+    return _per_type(rollups, REALTY_PER_TYPE)
+
+
+def available_per_type(rollups):
+    return _per_type(rollups, AVAILABLE_PER_TYPE)
+
+
+def available_realty(rollups):
+    stats = rollups.get(AVAILABLE_REALTY)
+    return int(stats.main_number) if stats else 0
+
+
+def count_available_realty():
+    """
+    Number of realty not in a deal, read from its rollup row alone. Like
+    read(), builds the rollups first if they never were.
+    """
+    rows = dict(Stats.objects.filter(name__in=[ROLLUPS_MARKER, AVAILABLE_REALTY])
+                .values_list("name", "main_number"))
+    if ROLLUPS_MARKER not in rows:
+        rebuild()
+        rows = dict(Stats.objects.filter(name=AVAILABLE_REALTY).values_list("name", "main_number"))
+    return int(rows[AVAILABLE_REALTY])
+
+
+def average_age(rollups, role):
+    stats = rollups.get(AGE + role)
+    if not stats or not stats.main_number:
+        return None
+    return datetime.date.today().year - stats.number2 / stats.main_number
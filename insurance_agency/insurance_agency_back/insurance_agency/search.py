@@ -0,0 +1,104 @@
+"""
+Full-text search over realty listings.
+
+On SQLite the listings are indexed in an FTS5 table (rowid = realty id) kept
+in sync by signal handlers (see signals.py), and matches are ranked with
+BM25. Other databases fall back to unranked icontains lookups.
+"""
+import logging
+import re
+
+from django.db import connection, transaction
+from django.db.models import FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+
+from .models import Realty, RealtyType
+
+
+logger = logging.getLogger(__name__)
+
+SEARCH_TABLE = "insurance_agency_realty_search"
+# BM25 weights of the indexed columns: name, address, type name
+WEIGHTS = (10.0, 2.0, 5.0)
+
+WORD = re.compile(r"\w+")
+
+
+def is_available():
+    return connection.vendor == "sqlite"
+
+
+def match_query(text):
+    """
+    FTS5 query finding listings that contain every word of ``text`` as a
+    word prefix, or None when there is nothing to search for.
+    """
+    # User input never reaches FTS5 syntax: only quoted words do
+    words = WORD.findall(text)
+    if not words:
+        return None
+    return " ".join(f'"{word}"*' for word in words)
+
+
+def _index(where, params):
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {SEARCH_TABLE} WHERE rowid IN "
+                       f"(SELECT realty.id FROM {Realty._meta.db_table} realty WHERE {where})", params)
+        cursor.execute(f"INSERT INTO {SEARCH_TABLE} (rowid, name, address, type_name) "
+                       f"SELECT realty.id, realty.name, realty.address, realty_type.name "
+                       f"FROM {Realty._meta.db_table} realty "
+                       f"JOIN {RealtyType._meta.db_table} realty_type ON realty_type.id = realty.type_id "
+                       f"WHERE {where}", params)
+
+
+def index_realty(pk):
+    if is_available():
+        _index("realty.id = %s", [pk])
+
+
+def index_type(pk):
+    # Every listing of the type carries its name
+    if is_available():
+        _index("realty.type_id = %s", [pk])
+
+
+def remove_realty(pk):
+    if is_available():
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {SEARCH_TABLE} WHERE rowid = %s", [pk])
+
+
+def rebuild():
+    if not is_available():
+        logger.info(f"Full-text search is not available on {connection.vendor}, nothing to rebuild")
+        return
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {SEARCH_TABLE}")
+        _index("1 = 1", [])
+        cursor.execute(f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}) VALUES ('optimize')")
+    logger.info("Realty search index rebuilt")
+
+
+def search(queryset, text):
+    """
+    Narrows the realty ``queryset`` down to listings matching ``text``.
+    When full-text search is available, they are annotated with
+    ``search_rank``: lower is more relevant.
+    """
+    if not is_available():
+        for word in text.split():
+            queryset = queryset.filter(Q(name__icontains=word) | Q(address__icontains=word)
+                                       | Q(type__name__icontains=word))
+        return queryset
+
+    query = match_query(text)
+    if query is None:
+        # Still sortable by relevance, like any other search
+        return queryset.none().annotate(search_rank=Value(0.0, output_field=FloatField()))
+    weights = ", ".join(map(str, WEIGHTS))
+    rank = RawSQL(f"SELECT bm25({SEARCH_TABLE}, {weights}) FROM {SEARCH_TABLE} "
+                  f"WHERE {SEARCH_TABLE} MATCH %s AND rowid = {Realty._meta.db_table}.id",
+                  [query], output_field=FloatField())
+    return (queryset
+            .filter(id__in=RawSQL(f"SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s", [query]))
+            .annotate(search_rank=rank))
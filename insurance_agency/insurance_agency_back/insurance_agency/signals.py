@@ -0,0 +1,125 @@
+import logging
+
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete
+
+from . import realty_cache, rollups, search, thumbnails, timeseries
+from .models import Deal, Realty, RealtyType, Customer, Employee, Owner, UserProfile
+
+
+logger = logging.getLogger(__name__)
+
+
+def _role_contributions(model):
+    role = rollups.role_of(model)
+    return lambda pk: rollups.role_contributions(role, rollups.role_snapshot(model, pk))
+
+
+# model: [(contributions of the object with the given pk, function applying a change of them)]
+TRACKED = {
+    Deal: [
+        (lambda pk: rollups.deal_contributions(rollups.deal_snapshot(pk)), rollups.apply),
+        (timeseries.deal_snapshot, timeseries.apply),
+    ],
+    Realty: [
+        (lambda pk: rollups.realty_contributions(rollups.realty_snapshot(pk)), rollups.apply),
+        (timeseries.realty_snapshot, timeseries.apply),
+    ],
+    Customer: [(_role_contributions(Customer), rollups.apply)],
+    Employee: [(_role_contributions(Employee), rollups.apply)],
+    Owner: [(_role_contributions(Owner), rollups.apply)],
+    # Not connected to the delete signals: removing a profile removes its
+    # roles, and those take their share out of the rollups themselves.
+    UserProfile: [(lambda pk: rollups.profile_contributions(rollups.profile_snapshot(pk)), rollups.apply)],
+}
+
+
+def remember_contributions(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    instance._rollup_contributions = [
+        contributions(instance.pk) if instance.pk else {}
+        for contributions, _ in TRACKED[sender]
+    ]
+
+
+def update_rollups(sender, instance, raw=False, **kwargs):
+    # Fixtures (raw saves) are skipped, run "manage.py rebuild_stats" after loading them
+    if raw:
+        return
+    # After a delete the object is gone, so its new contributions are empty
+    for old, (contributions, apply) in zip(instance._rollup_contributions, TRACKED[sender]):
+        apply(old, contributions(instance.pk))
+    rollups.bump_version()
+
+
+def bump_data_version(sender, raw=False, **kwargs):
+    if not raw:
+        rollups.bump_version()
+
+
+for model in TRACKED:
+    pre_save.connect(remember_contributions, sender=model)
+    post_save.connect(update_rollups, sender=model)
+    if model is not UserProfile:
+        pre_delete.connect(remember_contributions, sender=model)
+        post_delete.connect(update_rollups, sender=model)
+
+# Only shows up in the statistics by name
+post_save.connect(bump_data_version, sender=RealtyType)
+post_delete.connect(bump_data_version, sender=RealtyType)
+
+
+def index_realty(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.index_realty(instance.pk)
+
+
+def unindex_realty(sender, instance, **kwargs):
+    search.remove_realty(instance.pk)
+
+
+def index_realty_type(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.index_type(instance.pk)
+
+
+post_save.connect(index_realty, sender=Realty)
+post_delete.connect(unindex_realty, sender=Realty)
+post_save.connect(index_realty_type, sender=RealtyType)
+
+
+# Cached realty pages show the realty, its type and its owner
+def drop_cached_realty(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    if sender is Realty:
+        realty_cache.invalidate([instance.pk])
+    elif sender is RealtyType:
+        realty_cache.invalidate(Realty.objects.filter(type_id=instance.pk).values_list("pk", flat=True))
+    elif sender is Owner:
+        realty_cache.invalidate(Realty.objects.filter(owner_id=instance.pk).values_list("pk", flat=True))
+    elif sender is UserProfile:
+        realty_cache.invalidate(Realty.objects.filter(owner__user_id=instance.pk).values_list("pk", flat=True))
+
+
+for model in (Realty, RealtyType, Owner, UserProfile):
+    post_save.connect(drop_cached_realty, sender=model)
+post_delete.connect(drop_cached_realty, sender=Realty)
+
+
+def make_thumbnails(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    field = "photo" if sender is Realty else "image"
+    field_file = getattr(instance, field)
+    if not field_file:
+        return
+    # Anything that can't be thumbnailed is served as it is
+    try:
+        thumbnails.generate(field_file)
+    except Exception as error:
+        logger.warning(f"Could not make thumbnails of {field_file.name}: {error}")
+
+
+post_save.connect(make_thumbnails, sender=Realty)
+post_save.connect(make_thumbnails, sender=Employee)
@@ -0,0 +1,54 @@
+"""
+Sort orders the listings accept, by public key.
+
+Each key maps to an ordering some index can serve. paginate() breaks ties
+by id in the same direction, so every ordering is deterministic.
+"""
+from typing import NamedTuple
+
+from django.core.exceptions import BadRequest
+
+
+class SortOrder(NamedTuple):
+    label: str
+    # Field or annotation, "-" prefixed for descending
+    ordering: str
+    # Only meaningful for full-text searches
+    search: bool = False
+
+
+DEFAULT_SORT = "newest"
+SEARCH_SORT = "relevance"
+
+# Realty not in a deal: realty_available_price_idx / _area_idx and the primary key
+CATALOG_SORTS = {
+    "newest": SortOrder("Newest", "-id"),
+    "oldest": SortOrder("Oldest", "id"),
+    "price": SortOrder("Price (asc)", "price"),
+    "-price": SortOrder("Price (desc)", "-price"),
+    "area": SortOrder("Area (asc)", "area"),
+    "-area": SortOrder("Area (desc)", "-area"),
+    "relevance": SortOrder("Relevance", "search_rank", search=True),
+}
+
+# Realty of one owner: realty_owner_price_idx and the owner index
+MY_REALTY_SORTS = {key: CATALOG_SORTS[key] for key in ("newest", "oldest", "price", "-price", "relevance")}
+
+
+def resolve(sorts, key, searching):
+    """
+    Returns the public key and the SortOrder for ``key``, rejecting keys
+    ``sorts`` doesn't declare. Without a key, full-text searches are sorted
+    by relevance and everything else by newest; so are searches cleared
+    from a form that still asks for relevance.
+    """
+    if key and key not in sorts:
+        raise BadRequest(f"Unknown sort order '{key}'")
+    if not key or (sorts[key].search and not searching):
+        key = SEARCH_SORT if searching and SEARCH_SORT in sorts else DEFAULT_SORT
+    return key, sorts[key]
+
+
+def options(sorts, searching):
+    """(key, label) pairs to offer, in declaration order."""
+    return [(key, sort.label) for key, sort in sorts.items() if searching or not sort.search]
@@ -0,0 +1,12 @@
+from django import template
+
+from insurance_agency.thumbnails import thumbnail_url
+
+
+register = template.Library()
+
+
+@register.simple_tag
+def thumbnail(field_file, size):
+    """{% thumbnail realty.photo "list" %} - URL of the photo's "list" thumbnail."""
+    return thumbnail_url(field_file, size)
@@ -1,20 +1,71 @@
 import datetime
+import importlib
+import io
+import json
+import os
+import tempfile
 from decimal import Decimal
+from unittest.mock import patch
 import pytest
 
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.test import TestCase, Client
-from django.urls import reverse
+from django.core.cache import cache
+from django.core.management import call_command, CommandError
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F, Q
+from django.http import QueryDict
+from django.test import TestCase, Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import clear_url_caches, reverse
+from django.utils import timezone
 from django.core.files.uploadedfile import SimpleUploadedFile
 
 
-from insurance_agency.models import TypeOfWork, Employee, Owner, Customer, RealtyType, Realty, Deal, UserProfile
+from insurance_agency import deals, exports, reservations, rollups, search, thumbnails, timeseries, views
+from insurance_agency.facets import facet_counts
+from insurance_agency.pagination import encode_cursor
+from insurance_agency.models import TypeOfWork, Employee, Owner, Customer, RealtyType, Realty, Deal, UserProfile, \
+    Stats, DealQuerySet
+from insurance_agency_back.query_budget import Budget, QueryBudgetExceeded, assert_query_budget
+from insurance_agency_back import urls as root_urls
+from insurance_agency_back.storage import is_content_addressed
 
 
 User = get_user_model()
 pytestmark = pytest.mark.django_db
 
 
+def create_profile(username, birth_day=datetime.date(1980, 1, 1), **kwargs):
+    user = User.objects.create_user(username=username, password="12345")
+    return UserProfile.objects.create(user=user, full_name=username.title(), email=f"{username}@example.com",
+                                      birth_day=birth_day, **kwargs)
+
+
+def create_owner(username="owner"):
+    return Owner.objects.create(user=create_profile(username, is_owner=True))
+
+
+def create_customer(username="customer"):
+    return Customer.objects.create(user=create_profile(username, is_customer=True))
+
+
+def create_realty(owner, realty_type, name="Sunny flat", **kwargs):
+    """A 1000.00, 50 m² realty unless told otherwise."""
+    fields = {"address": "Street", "price": Decimal("1000.00"), "area": Decimal("50.00"), **kwargs}
+    return Realty.objects.create(type=realty_type, owner=owner, name=name, **fields)
+
+
+def use_temporary_media_root(test):
+    """Points MEDIA_ROOT to a directory removed after ``test``, and returns it."""
+    media = tempfile.TemporaryDirectory()
+    test.addCleanup(media.cleanup)
+    settings_override = override_settings(MEDIA_ROOT=media.name)
+    settings_override.enable()
+    test.addCleanup(settings_override.disable)
+    return media.name
+
+
 # Create your tests here.
 class ModelsTestCase(TestCase):
 
@@ -360,3 +411,904 @@ class RealtyTests(TestCase):
         self.assertEqual(response.status_code, 200)
         self.user.refresh_from_db()
         self.assertTrue(Realty.objects.filter(owner=self.owner).exists())
+
+
+class RollupsTests(TestCase):
+    def setUp(self):
+        rollups.rebuild()
+        self.owner = Owner.objects.create(user=create_profile("owner", datetime.date(1970, 1, 1)))
+        self.customer = Customer.objects.create(user=create_profile("customer", datetime.date(2000, 1, 1)))
+        self.employee = Employee.objects.create(user=create_profile("employee", datetime.date(1990, 1, 1)))
+        self.flat = RealtyType.objects.create(name="Flat")
+        self.house = RealtyType.objects.create(name="House")
+        self.realty = create_realty(self.owner, self.flat, price=Decimal("100000.00"))
+        self.deal = Deal.objects.create(deal_type=Deal.DealType.SALE, realty=self.realty, customer=self.customer,
+                                        owner=self.owner, employee=self.employee)
+
+    def assertNoDrift(self):
+        self.assertEqual(rollups.drift(), {})
+
+    def test_rollups_follow_creation(self):
+        self.assertNoDrift()
+        stats = rollups.read()
+        self.assertEqual(rollups.deals_total_value(stats), Decimal("100000.00"))
+        self.assertEqual(rollups.deals_per_employee(stats), [("Employee", 1)])
+        self.assertEqual(rollups.realty_per_type(stats), [("Flat", 1)])
+        self.assertEqual(rollups.average_age(stats, "customer"), datetime.date.today().year - 2000)
+
+    def test_rollups_follow_updates(self):
+        self.realty.price = Decimal("150000.00")
+        self.realty.type = self.house
+        self.realty.save()
+        self.deal.employee = None
+        self.deal.save()
+        profile = self.customer.user
+        profile.birth_day = datetime.date(1980, 5, 5)
+        profile.save()
+
+        self.assertNoDrift()
+        stats = rollups.read()
+        self.assertEqual(rollups.deals_total_value(stats), Decimal("150000.00"))
+        self.assertEqual(rollups.deals_per_employee(stats), [])
+        self.assertEqual(rollups.average_age(stats, "customer"), datetime.date.today().year - 1980)
+
+    def test_rollups_follow_deletes(self):
+        self.deal.delete()
+        self.realty.delete()
+        self.employee.user.delete()
+
+        self.assertNoDrift()
+        stats = rollups.read()
+        self.assertEqual(rollups.deals_total_value(stats), 0)
+        self.assertIsNone(rollups.average_age(stats, "employee"))
+
+    def test_reading_rollups_is_constant(self):
+        rollups.read()
+        for i in range(5):
+            Deal.objects.create(deal_type=Deal.DealType.RENT, status=Deal.DealStatus.COMPLETED, realty=self.realty,
+                                customer=self.customer, owner=self.owner, employee=self.employee)
+        with self.assertNumQueries(1):
+            rollups.read()
+
+    def test_rebuild_stats_command(self):
+        Stats.objects.filter(name=rollups.DEALS_TOTAL_VALUE).update(main_number=1)
+        with self.assertRaises(CommandError):
+            call_command("rebuild_stats", "--check", stdout=io.StringIO())
+
+        call_command("rebuild_stats", stdout=io.StringIO())
+        call_command("rebuild_stats", "--check", stdout=io.StringIO())
+
+    def test_float_rounding_is_not_drift(self):
+        total = Stats.objects.filter(name=rollups.DEALS_TOTAL_VALUE)
+        total.update(main_number=F("main_number") + 2e-5)
+        self.assertNoDrift()
+        total.update(main_number=F("main_number") + 0.01)
+        self.assertIn(rollups.DEALS_TOTAL_VALUE, rollups.drift())
+
+    def test_reconcile_only_rebuilds_on_drift(self):
+        out = io.StringIO()
+        call_command("rebuild_stats", "--reconcile", stdout=out)
+        self.assertIn("up to date", out.getvalue())
+
+        Realty.objects.filter(pk=self.realty.pk).update(is_in_deal=True)
+        out = io.StringIO()
+        with self.assertLogs("insurance_agency.rollups", "WARNING"):
+            call_command("rebuild_stats", "--reconcile", stdout=out)
+        self.assertIn("available_realty drifted", out.getvalue())
+        self.assertEqual(rollups.count_available_realty(), 0)
+        self.assertNoDrift()
+
+    def test_deal_views_take_realty_off_the_catalog_atomically(self):
+        # Only one open deal per realty
+        self.deal.status = Deal.DealStatus.CANCELLED
+        self.deal.save()
+        self.client.force_login(self.customer.user.user)
+        url = reverse("deal-create", args=[self.realty.pk])
+        self.client.get(url)
+        self.assertEqual(rollups.count_available_realty(), 1)
+
+        with patch.object(Deal, "save", side_effect=RuntimeError("database is gone")):
+            with self.assertRaises(RuntimeError):
+                self.client.post(url, {"deal_type": Deal.DealType.RENT})
+        self.realty.refresh_from_db()
+        self.assertFalse(self.realty.is_in_deal)
+        self.assertEqual(rollups.count_available_realty(), 1)
+
+        self.client.post(url, {"deal_type": Deal.DealType.RENT})
+        self.realty.refresh_from_db()
+        self.assertTrue(self.realty.is_in_deal)
+        self.assertEqual(rollups.count_available_realty(), 0)
+
+        deal = Deal.objects.get(deal_type=Deal.DealType.RENT)
+        self.client.post(reverse("deal-delete", args=[deal.pk]))
+        self.assertEqual(rollups.count_available_realty(), 1)
+        self.assertNoDrift()
+
+    def test_available_realty_counters(self):
+        self.assertEqual(rollups.count_available_realty(), 1)
+        other = create_realty(self.owner, self.house, "Big house", price=Decimal("300000.00"),
+                              area=Decimal("150.00"))
+        self.assertEqual(rollups.available_per_type(rollups.read()), [("Flat", 1), ("House", 1)])
+
+        self.realty.is_in_deal = True
+        self.realty.save()
+        self.assertEqual(rollups.count_available_realty(), 1)
+        other.delete()
+        with self.assertNumQueries(1):
+            self.assertEqual(rollups.count_available_realty(), 0)
+        self.assertNoDrift()
+
+    def test_available_realty_builds_missing_rollups(self):
+        # A row moved by a delta before the rollups were ever built
+        Stats.objects.all().delete()
+        Stats.objects.create(name=rollups.AVAILABLE_REALTY, main_number=-1, number2=0)
+        self.assertEqual(rollups.count_available_realty(), 1)
+        self.assertTrue(Stats.objects.filter(name=rollups.ROLLUPS_MARKER).exists())
+
+    def test_deal_lifecycle_timestamps(self):
+        self.assertIsNotNone(self.deal.created_at)
+        self.assertIsNone(self.deal.closed_at)
+
+        self.deal.status = Deal.DealStatus.COMPLETED
+        self.deal.save()
+        self.assertIsNotNone(self.deal.closed_at)
+
+        self.deal.status = Deal.DealStatus.ACTIVE
+        self.deal.save(update_fields=["status"])
+        self.deal.refresh_from_db()
+        self.assertIsNone(self.deal.closed_at)
+
+    def test_time_series_follows_deals(self):
+        self.deal.status = Deal.DealStatus.COMPLETED
+        self.deal.save()
+        Deal.objects.create(deal_type=Deal.DealType.RENT, realty=self.realty, customer=self.customer,
+                            owner=self.owner)
+        self.realty.price = Decimal("120000.00")
+        self.realty.save()
+
+        self.assertNoDrift()
+        today = timezone.localdate()
+        rows = timeseries.series(today, today)
+        self.assertEqual([(row["deal_type"], row["status"], row["opened"], row["opened_value"], row["closed"])
+                          for row in rows],
+                         [("RENT", "DRAFT", 1, Decimal("120000.00"), 0),
+                          ("SALE", "COMPLETED", 1, Decimal("120000.00"), 1)])
+
+    def test_time_series_after_delete(self):
+        self.deal.delete()
+        self.assertNoDrift()
+        today = timezone.localdate()
+        self.assertEqual(timeseries.series(today, today), [])
+
+
+@override_settings(LISTING_PAGE_SIZE=2)
+class ListingPaginationTests(TestCase):
+    def setUp(self):
+        self.owner = Owner.objects.create(user=create_profile("owner"))
+        self.user = self.owner.user.user
+        flat = RealtyType.objects.create(name="Flat")
+        # Equal prices make the id tie-break matter
+        self.realties = [
+            create_realty(self.owner, flat, f"Flat {i}", price=Decimal(price))
+            for i, price in enumerate(["300.00", "100.00", "200.00", "100.00", "200.00"])
+        ]
+        self.realties[2].is_in_deal = True
+        self.realties[2].save()
+        rollups.rebuild()
+
+    def walk(self, url, params, count=4):
+        names, cursor = [], None
+        while True:
+            response = self.client.get(url, {**params, "cursor": cursor} if cursor else params)
+            self.assertEqual(response.context["offers"], count)
+            names += [realty.name for realty in response.context["insurances"]]
+            cursor = response.context["next_cursor"]
+            if not cursor:
+                return names
+
+    def test_pages_follow_sort_order(self):
+        url = reverse("insurances-list")
+        self.assertEqual(self.walk(url, {}), ["Flat 4", "Flat 3", "Flat 1", "Flat 0"])
+        self.assertEqual(self.walk(url, {"sort_by": "price"}), ["Flat 1", "Flat 3", "Flat 4", "Flat 0"])
+        self.assertEqual(self.walk(url, {"sort_by": "-price"}), ["Flat 0", "Flat 4", "Flat 3", "Flat 1"])
+
+    def test_my_insurances_are_paginated(self):
+        self.client.force_login(self.user)
+        names = self.walk(reverse("my-my_insurances"), {"sort_by": "price"}, count=5)
+        self.assertEqual(names, ["Flat 1", "Flat 3", "Flat 2", "Flat 4", "Flat 0"])
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse("insurances-list"), {"sort_by": "price", "cursor": "garbage"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_only_registered_sorts_are_accepted(self):
+        url = reverse("insurances-list")
+        self.assertEqual(self.walk(url, {"sort_by": "oldest"}), ["Flat 0", "Flat 1", "Flat 3", "Flat 4"])
+        for sort_by in ("owner__user__email", "name", "-id"):
+            self.assertEqual(self.client.get(url, {"sort_by": sort_by}).status_code, 400)
+
+        # Relevance without a search falls back to the default order
+        response = self.client.get(url, {"sort_by": "relevance"})
+        self.assertEqual(response.context["sort_by"], "newest")
+        self.assertNotIn("relevance", dict(response.context["sort_options"]))
+
+    def test_my_insurances_sorts(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse("my-my_insurances"), {"sort_by": "area"})
+        self.assertEqual(response.status_code, 400)
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        self.owner = Owner.objects.create(user=create_profile("owner"))
+        self.flat = RealtyType.objects.create(name="Flat")
+        self.office = RealtyType.objects.create(name="Office")
+        self.sunny = create_realty(self.owner, self.flat, "Sunny flat", address="Lenina 1")
+        self.garden = create_realty(self.owner, self.flat, "Garden house", address="Sunny street 5")
+        self.tower = create_realty(self.owner, self.office, "Tower", address="Pobedy 10")
+
+    def names(self, text):
+        return [realty.name for realty in search.search(Realty.objects.all(), text).order_by("search_rank", "id")]
+
+    def test_ranked_across_name_address_and_type(self):
+        # A name match outranks an address match
+        self.assertEqual(self.names("sunny"), ["Sunny flat", "Garden house"])
+        self.assertEqual(self.names("offi"), ["Tower"])
+        self.assertEqual(self.names("flat lenina"), ["Sunny flat"])
+        self.assertEqual(self.names('" OR *'), [])
+
+    def test_index_follows_changes(self):
+        self.tower.name = "Sunny tower"
+        self.tower.save()
+        self.assertIn("Sunny tower", self.names("sunny"))
+
+        self.office.name = "Warehouse"
+        self.office.save()
+        self.assertEqual(self.names("warehouse"), ["Sunny tower"])
+
+        self.garden.delete()
+        self.assertEqual(self.names("garden"), [])
+
+    def test_rebuild_command(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {search.SEARCH_TABLE}")
+        self.assertEqual(self.names("tower"), [])
+
+        call_command("rebuild_search_index", stdout=io.StringIO())
+        self.assertEqual(self.names("tower"), ["Tower"])
+
+    def test_listing_is_ordered_by_relevance(self):
+        response = self.client.get(reverse("insurances-list"), {"q": "sunny"})
+        self.assertEqual([realty.name for realty in response.context["insurances"]], ["Sunny flat", "Garden house"])
+        self.assertEqual(response.context["offers"], 2)
+
+        with override_settings(LISTING_PAGE_SIZE=1):
+            first = self.client.get(reverse("insurances-list"), {"q": "sunny"})
+            second = self.client.get(reverse("insurances-list"), {"q": "sunny", "cursor": first.context["next_cursor"]})
+        self.assertEqual([realty.name for realty in second.context["insurances"]], ["Garden house"])
+        self.assertIsNone(second.context["next_cursor"])
+
+    def test_queries_without_words(self):
+        rollups.rebuild()
+        response = self.client.get(reverse("insurances-list"), {"q": " "})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context["offers"], 3)
+
+        response = self.client.get(reverse("insurances-list"), {"q": '"*'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.context["insurances"]), [])
+
+
+class FacetTests(TestCase):
+    def setUp(self):
+        owner = Owner.objects.create(user=create_profile("owner"))
+        flat = RealtyType.objects.create(name="Flat")
+        office = RealtyType.objects.create(name="Office", category=RealtyType.RealtyCategory.COMMERCIAL)
+        for i, (realty_type, price, area, built_year) in enumerate([
+            (flat, "40000.00", "45.00", 1975),
+            (flat, "90000.00", "70.00", 2005),
+            (office, "300000.00", "250.00", 2015),
+            (office, "95000.00", "120.00", None),
+        ]):
+            create_realty(owner, realty_type, f"Realty {i}", price=Decimal(price), area=Decimal(area),
+                          built_year=built_year)
+        realty = Realty.objects.get(name="Realty 3")
+        realty.is_in_deal = True
+        realty.save()
+        rollups.rebuild()
+
+    def get(self, **params):
+        return self.client.get(reverse("insurances-list"), params)
+
+    def counts(self, facets, name):
+        return [bucket["count"] for bucket in facets[name]]
+
+    def test_counts_cover_current_results_in_one_query(self):
+        queryset = Realty.objects.exclude(is_in_deal=True)
+        with self.assertNumQueries(1):
+            facets = facet_counts(queryset)
+
+        self.assertEqual(self.counts(facets, "price"), [1, 1, 0, 1, 0, 0])
+        self.assertEqual(self.counts(facets, "area"), [1, 1, 0, 1])
+        self.assertEqual(self.counts(facets, "built_year"), [0, 1, 0, 1, 1])
+        self.assertEqual(self.counts(facets, "category"), [2, 1, 0, 0])
+
+    def test_filters(self):
+        response = self.get(price_min="50000", price_max="100000")
+        self.assertEqual([realty.name for realty in response.context["insurances"]], ["Realty 1"])
+        self.assertEqual(self.counts(response.context["facets"], "category"), [1, 0, 0, 0])
+
+        response = self.get(category="COM")
+        self.assertEqual([realty.name for realty in response.context["insurances"]], ["Realty 2"])
+
+        response = self.get(built_year_min="2000", area_max="100")
+        self.assertEqual([realty.name for realty in response.context["insurances"]], ["Realty 1"])
+
+    def test_bucket_links_keep_other_filters(self):
+        response = self.get(category="RES", cursor=encode_cursor(["999", 999]))
+        link = QueryDict(response.context["facets"]["price"][1]["query"])
+        self.assertEqual(link.dict(), {"category": "RES", "price_min": "50000", "price_max": "100000"})
+
+    def test_invalid_filters_are_ignored(self):
+        response = self.get(price_min="cheap", category="CASTLE")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context["offers"], 3)
+        self.assertTrue(response.context["filter_form"].errors)
+
+
+class ListingQueryTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser(username="admin", password="12345")
+        self.profile = create_profile("member", is_owner=True, is_customer=True)
+        member_owner = Owner.objects.create(user=self.profile)
+        member_customer = Customer.objects.create(user=self.profile)
+        flat = RealtyType.objects.create(name="Flat")
+        work_type = TypeOfWork.objects.create(name="Agent")
+        for i in range(5):
+            owner = Owner.objects.create(user=create_profile(f"owner{i}"))
+            customer = Customer.objects.create(user=create_profile(f"customer{i}"))
+            employee = Employee.objects.create(user=create_profile(f"employee{i}"), work_type=work_type)
+            for realty_owner, deal_customer in ((owner, member_customer), (member_owner, customer)):
+                realty = create_realty(realty_owner, flat, f"Realty {realty_owner.pk}-{i}")
+                Deal.objects.create(deal_type=Deal.DealType.SALE, realty=realty, customer=deal_customer,
+                                    owner=realty_owner, employee=employee)
+            create_realty(owner, flat, f"Available {i}")
+        rollups.rebuild()
+
+    def assertListingQueries(self, user, url_name, rows_key, rows, queries):
+        self.client.force_login(user)
+        with self.assertNumQueries(queries):
+            response = self.client.get(reverse(url_name))
+        self.assertEqual(len(response.context[rows_key]), rows)
+
+    def test_list_pages_do_not_query_per_row(self):
+        # Session, user and the timezone profile lookup come on top of the listing itself
+        self.assertListingQueries(self.admin, "deals", "deals", 10, 4)
+        self.assertListingQueries(self.admin, "customers", "customers", 6, 4)
+        self.assertListingQueries(self.admin, "employees", "employees", 5, 4)
+        # Count, page and facet counts
+        self.assertListingQueries(self.admin, "insurances-list", "insurances", 15, 6)
+
+    def test_my_pages_do_not_query_per_row(self):
+        member = self.profile.user
+        # Both roles in one query, without a count
+        self.assertListingQueries(member, "my-deals", "deals", 10, 4)
+        # Plus the profile and role lookups of the view itself
+        self.assertListingQueries(member, "my-my_insurances", "insurances", 5, 8)
+
+    @override_settings(LISTING_PAGE_SIZE=4)
+    def test_my_deals_are_paginated_newest_first(self):
+        member_owner = Owner.objects.get(user=self.profile)
+        member_customer = Customer.objects.get(user=self.profile)
+        realty = create_realty(member_owner, RealtyType.objects.get(name="Flat"), "Own flat")
+        # Owner and customer at once: still listed once
+        own_deal = Deal.objects.create(deal_type=Deal.DealType.RENT, realty=realty, customer=member_customer,
+                                       owner=member_owner)
+        expected = list(Deal.objects.filter(Q(owner=member_owner) | Q(customer=member_customer))
+                        .order_by("-created_at", "-id").values_list("pk", flat=True))
+        self.assertEqual(len(expected), 11)
+        self.assertEqual(expected[0], own_deal.pk)
+
+        self.client.force_login(self.profile.user)
+        seen, query = [], ""
+        while True:
+            response = self.client.get(reverse("my-deals") + "?" + query)
+            seen.extend(deal.pk for deal in response.context["deals"])
+            if not response.context["next_cursor"]:
+                break
+            query = response.context["next_page_query"]
+        self.assertEqual(seen, expected)
+
+    def test_query_budget_is_enforced(self):
+        self.client.force_login(self.admin)
+        with patch.object(views.deals, "query_budget", Budget(queries=2)):
+            with self.assertRaises(QueryBudgetExceeded):
+                self.client.get(reverse("deals"))
+
+        response = self.client.get(reverse("deals"))
+        self.assertEqual(response.wsgi_request.query_stats.count, 4)
+        self.assertEqual(response.wsgi_request.query_stats.duplicates(), {})
+
+    @override_settings(DEBUG=True, QUERY_BUDGET_ENFORCE=False)
+    def test_repeated_queries_are_logged_in_development(self):
+        self.client.force_login(self.admin)
+        with patch.object(DealQuerySet, "listing_related", ()):
+            with self.assertLogs("insurance_agency_back.middleware", "WARNING") as logs:
+                self.client.get(reverse("deals"))
+        self.assertIn("queries, budget is 5", logs.output[0])
+        self.assertIn('10x SELECT "insurance_agency_realty"', logs.output[0])
+
+    def test_assert_query_budget(self):
+        with assert_query_budget(queries=1) as recorder:
+            list(Deal.objects.for_listing())
+        self.assertEqual(recorder.count, 1)
+
+        with self.assertRaisesMessage(QueryBudgetExceeded, "10x SELECT"):
+            with assert_query_budget(queries=5):
+                [deal.realty.name for deal in Deal.objects.all()]
+
+
+class RealtyDetailTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.owner = create_owner()
+        self.customer = create_customer()
+        self.realty = create_realty(self.owner, RealtyType.objects.create(name="Flat"))
+        self.url = reverse("realty-detail", args=[self.realty.pk])
+
+    def test_cached_page_only_queries_the_viewer(self):
+        self.client.force_login(self.customer.user.user)
+        # Session, user and profile, plus the realty with its type and owner
+        with self.assertNumQueries(4):
+            response = self.client.get(self.url)
+        self.assertTrue(response.context["is_customer"])
+        self.assertFalse(response.context["is_owner"])
+
+        with self.assertNumQueries(3):
+            response = self.client.get(self.url)
+        self.assertContains(response, "Make a deal")
+        self.assertContains(response, "owner@example.com")
+
+    def test_changes_drop_the_cached_page(self):
+        self.client.get(self.url)
+        self.realty.price = Decimal("2500.00")
+        self.realty.save()
+        self.assertContains(self.client.get(self.url), "2500.00")
+
+        profile = self.owner.user
+        profile.email = "new-owner@example.com"
+        profile.save()
+        self.assertContains(self.client.get(self.url), "new-owner@example.com")
+
+        self.realty.delete()
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+    def test_owner_and_anonymous_viewers(self):
+        self.client.force_login(self.owner.user.user)
+        response = self.client.get(self.url)
+        self.assertTrue(response.context["is_owner"])
+        self.assertContains(response, "Edit insurance")
+
+        self.client.logout()
+        response = self.client.get(self.url)
+        self.assertFalse(response.context["is_owner"])
+        self.assertContains(response, "add some customer info")
+
+
+class ThumbnailTests(TestCase):
+    def setUp(self):
+        self.media_root = use_temporary_media_root(self)
+        self.owner = create_owner()
+        self.type = RealtyType.objects.create(name="Flat")
+
+    def image(self, name="flat.png", size=(1600, 1000), mode="RGBA"):
+        from PIL import Image
+
+        content = io.BytesIO()
+        Image.new(mode, size, "red").save(content, "PNG")
+        return SimpleUploadedFile(name, content.getvalue(), content_type="image/png")
+
+    def create_realty(self, photo):
+        return create_realty(self.owner, self.type, photo=photo)
+
+    def thumbnail_size(self, field_file, size):
+        from PIL import Image
+
+        with Image.open(os.path.join(self.media_root, thumbnails.thumbnail_name(field_file.name, size))) as image:
+            return image.format, image.size
+
+    def test_thumbnails_are_made_on_upload(self):
+        realty = self.create_realty(self.image())
+
+        self.assertEqual(self.thumbnail_size(realty.photo, "list"), ("JPEG", (400, 250)))
+        self.assertEqual(self.thumbnail_size(realty.photo, "detail"), ("JPEG", (550, 344)))
+        self.assertFalse(os.path.exists(os.path.join(self.media_root,
+                                                     thumbnails.thumbnail_name(realty.photo.name, "avatar"))))
+
+        employee = Employee.objects.create(user=self.owner.user, image=self.image("face.jpg", mode="RGB"))
+        self.assertEqual(self.thumbnail_size(employee.image, "avatar"), ("JPEG", (250, 250)))
+
+    def test_template_tag_makes_missing_thumbnails(self):
+        realty = self.create_realty(self.image())
+        os.remove(os.path.join(self.media_root, thumbnails.thumbnail_name(realty.photo.name, "detail")))
+
+        response = self.client.get(reverse("realty-detail", args=[realty.pk]))
+        self.assertContains(response, f'src="/media/{thumbnails.thumbnail_name(realty.photo.name, "detail")}"')
+        self.assertEqual(self.thumbnail_size(realty.photo, "detail"), ("JPEG", (550, 344)))
+
+    def test_unreadable_photo_is_served_as_it_is(self):
+        with self.assertLogs("insurance_agency.signals", "WARNING"):
+            realty = self.create_realty(SimpleUploadedFile("broken.png", b"not an image",
+                                                           content_type="image/png"))
+
+        with self.assertLogs("insurance_agency.thumbnails", "WARNING"):
+            self.assertEqual(thumbnails.thumbnail_url(realty.photo, "list"), realty.photo.url)
+        self.assertEqual(thumbnails.thumbnail_url(Realty(photo=None).photo, "list"), "")
+
+    def test_command_backfills_thumbnails(self):
+        realty = self.create_realty(self.image())
+        name = os.path.join(self.media_root, thumbnails.thumbnail_name(realty.photo.name, "list"))
+        os.remove(name)
+
+        out = io.StringIO()
+        call_command("generate_thumbnails", stdout=out)
+        self.assertIn("Generated 1 thumbnails, 0 photos failed", out.getvalue())
+        self.assertTrue(os.path.exists(name))
+
+        call_command("generate_thumbnails", "--force", stdout=out)
+        self.assertIn("Generated 2 thumbnails, 0 photos failed", out.getvalue())
+
+
+class ContentAddressedStorageTests(TestCase):
+    def setUp(self):
+        self.media_root = use_temporary_media_root(self)
+        self.owner = create_owner()
+        self.type = RealtyType.objects.create(name="Flat")
+
+    def create_realty(self, name, photo):
+        return create_realty(self.owner, self.type, name, photo=photo)
+
+    def write_legacy_file(self):
+        os.makedirs(os.path.join(self.media_root, "realties"), exist_ok=True)
+        with open(os.path.join(self.media_root, "realties", "legacy.png"), "wb") as legacy:
+            legacy.write(b"legacy")
+
+    def test_identical_uploads_share_one_file(self):
+        first = self.create_realty("Sunny flat", SimpleUploadedFile("flat.PNG", b"same content"))
+        second = self.create_realty("Other flat", SimpleUploadedFile("copy.png", b"same content"))
+        third = self.create_realty("Third flat", SimpleUploadedFile("flat.png", b"other content"))
+
+        self.assertEqual(first.photo.name, second.photo.name)
+        self.assertNotEqual(first.photo.name, third.photo.name)
+        self.assertRegex(first.photo.name, r"^realties/[0-9a-f]{2}/[0-9a-f]{64}\.png$")
+        stored = os.listdir(os.path.dirname(first.photo.path)) + os.listdir(os.path.dirname(third.photo.path))
+        self.assertEqual(sorted(stored), sorted([os.path.basename(first.photo.name),
+                                                 os.path.basename(third.photo.name)]))
+
+    def serve_media(self):
+        # static() only adds the media URL with DEBUG on, when the URLconf is imported
+        def reload_urls():
+            importlib.reload(root_urls)
+            clear_url_caches()
+        with override_settings(DEBUG=True):
+            reload_urls()
+        self.addCleanup(reload_urls)
+
+    def test_content_addressed_media_is_served_as_immutable(self):
+        self.serve_media()
+        realty = self.create_realty("Sunny flat", SimpleUploadedFile("flat.png", b"content"))
+        self.write_legacy_file()
+
+        response = self.client.get(realty.photo.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Cache-Control"], "public, max-age=31536000, immutable")
+        self.assertTrue(is_content_addressed(thumbnails.thumbnail_name(realty.photo.name, "list")))
+
+        response = self.client.get(settings.MEDIA_URL + "realties/legacy.png")
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header("Cache-Control"))
+
+    def test_command_moves_legacy_files(self):
+        realty = self.create_realty("Sunny flat", None)
+        self.write_legacy_file()
+        Realty.objects.filter(pk=realty.pk).update(photo="realties/legacy.png")
+
+        out = io.StringIO()
+        call_command("content_address_media", "--delete-originals", stdout=out)
+        self.assertIn("Moved 1 files, 0 missing", out.getvalue())
+
+        realty.refresh_from_db()
+        self.assertTrue(is_content_addressed(realty.photo.name))
+        self.assertEqual(realty.photo.read(), b"legacy")
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, "realties", "legacy.png")))
+
+        call_command("content_address_media", stdout=out)
+        self.assertIn("Moved 0 files, 0 missing", out.getvalue())
+
+
+class ReservationTests(TestCase):
+    def setUp(self):
+        rollups.rebuild()
+        self.owner = create_owner()
+        self.first = create_customer("first")
+        self.second = create_customer("second")
+        self.realty = create_realty(self.owner, RealtyType.objects.create(name="Flat"))
+        self.url = reverse("deal-create", args=[self.realty.pk])
+
+    def test_opening_the_form_reserves_the_realty(self):
+        self.client.force_login(self.first.user.user)
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+        self.realty.refresh_from_db()
+        self.assertEqual(self.realty.reserved_by, self.first)
+        self.assertFalse(self.realty.is_in_deal)
+
+        self.client.force_login(self.second.user.user)
+        self.assertRedirects(self.client.get(self.url), reverse("realty-detail", args=[self.realty.pk]))
+        self.client.post(self.url, {"deal_type": Deal.DealType.RENT})
+        self.assertFalse(Deal.objects.exists())
+
+        self.client.force_login(self.first.user.user)
+        self.assertRedirects(self.client.post(self.url, {"deal_type": Deal.DealType.RENT}), reverse("my-deals"))
+        self.realty.refresh_from_db()
+        self.assertTrue(self.realty.is_in_deal)
+        self.assertIsNone(self.realty.reserved_by)
+        self.assertEqual(Deal.objects.get().customer, self.first)
+        self.assertEqual(rollups.drift(), {})
+
+    def test_reservations_expire(self):
+        self.assertTrue(reservations.reserve(self.realty.pk, self.first, ttl=60))
+        self.assertFalse(reservations.reserve(self.realty.pk, self.second))
+        with self.assertRaises(reservations.RealtyUnavailable):
+            reservations.claim(self.realty.pk, self.second)
+
+        expire = Realty.objects.filter(pk=self.realty.pk)
+        expire.update(reserved_until=timezone.now() - datetime.timedelta(seconds=1))
+        self.assertTrue(reservations.reserve(self.realty.pk, self.second))
+        expire.update(reserved_until=timezone.now() - datetime.timedelta(seconds=1))
+        reservations.claim(self.realty.pk, self.first)
+        self.assertFalse(reservations.reserve(self.realty.pk, self.first))
+        self.assertEqual(rollups.count_available_realty(), 0)
+        self.assertEqual(rollups.drift(), {})
+
+    def test_one_open_deal_per_realty(self):
+        Deal.objects.create(deal_type=Deal.DealType.SALE, realty=self.realty, customer=self.first, owner=self.owner)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Deal.objects.create(deal_type=Deal.DealType.RENT, realty=self.realty, customer=self.second,
+                                owner=self.owner)
+        Deal.objects.update(status=Deal.DealStatus.CANCELLED)
+        Deal.objects.create(deal_type=Deal.DealType.RENT, realty=self.realty, customer=self.second, owner=self.owner)
+
+
+class DealVersionTests(TestCase):
+    def setUp(self):
+        rollups.rebuild()
+        owner = create_owner()
+        customer = create_customer()
+        self.first = Employee.objects.create(user=create_profile("first"))
+        self.second = Employee.objects.create(user=create_profile("second"))
+        realty = create_realty(owner, RealtyType.objects.create(name="Flat"), is_in_deal=True)
+        self.deal = Deal.objects.create(deal_type=Deal.DealType.SALE, realty=realty, customer=customer, owner=owner)
+        self.url = reverse("deal-update", args=[self.deal.pk])
+
+    def edit(self, employee, version, status):
+        self.client.force_login(employee.user.user)
+        return self.client.post(self.url, {"status": status, "version": version})
+
+    def test_opening_the_form_writes_nothing(self):
+        self.client.force_login(self.first.user.user)
+        response = self.client.get(self.url)
+        self.assertContains(response, 'name="version" value="0"')
+        self.deal.refresh_from_db()
+        self.assertIsNone(self.deal.employee)
+        self.assertEqual(self.deal.version, 0)
+
+    def test_later_writer_gets_a_conflict(self):
+        self.assertRedirects(self.edit(self.first, 0, Deal.DealStatus.ACTIVE), reverse("deals"),
+                             fetch_redirect_response=False)
+        response = self.edit(self.second, 0, Deal.DealStatus.CANCELLED)
+        self.assertEqual(response.status_code, 409)
+        self.assertContains(response, "changed by someone else", status_code=409)
+
+        self.deal.refresh_from_db()
+        self.assertEqual(self.deal.status, Deal.DealStatus.ACTIVE)
+        self.assertEqual(self.deal.employee, self.first)
+        self.assertEqual(self.deal.version, 1)
+        self.assertEqual(rollups.drift(), {})
+
+        self.assertRedirects(self.edit(self.second, 1, Deal.DealStatus.CANCELLED), reverse("deals"),
+                             fetch_redirect_response=False)
+        self.deal.refresh_from_db()
+        self.assertEqual((self.deal.status, self.deal.employee, self.deal.version),
+                         (Deal.DealStatus.CANCELLED, self.first, 2))
+        # Cancelling gives the realty back to the catalog
+        self.assertFalse(self.deal.realty.is_in_deal)
+        self.assertEqual(rollups.drift(), {})
+
+    def test_admin_edits_conflict_with_open_forms(self):
+        self.client.force_login(User.objects.create_superuser(username="admin", password="12345"))
+        url = reverse("admin:insurance_agency_deal_change", args=[self.deal.pk])
+        form = self.client.get(url).context["adminform"].form
+        data = {name: value for name, value in form.initial.items() if name in form.fields and value is not None}
+        data.update(status=Deal.DealStatus.ACTIVE, employee=self.second.pk)
+        self.assertEqual(self.client.post(url, data).status_code, 302)
+        self.deal.refresh_from_db()
+        self.assertEqual((self.deal.status, self.deal.version), (Deal.DealStatus.ACTIVE, 1))
+
+        # Opened before the admin's change
+        self.assertEqual(self.edit(self.first, 0, Deal.DealStatus.CANCELLED).status_code, 409)
+        self.deal.refresh_from_db()
+        self.assertEqual(self.deal.status, Deal.DealStatus.ACTIVE)
+
+    def test_form_only_offers_allowed_transitions(self):
+        response = self.edit(self.first, 0, Deal.DealStatus.COMPLETED)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("status", response.context["form"].errors)
+        self.assertEqual([value for value, _ in response.context["form"].fields["status"].choices],
+                         ["DRAFT", "ACTIVE", "CANCELLED"])
+        self.deal.refresh_from_db()
+        self.assertEqual(self.deal.status, Deal.DealStatus.DRAFT)
+
+
+class DealTransitionTests(TestCase):
+    def setUp(self):
+        rollups.rebuild()
+        owner = create_owner()
+        customer = create_customer()
+        flat = RealtyType.objects.create(name="Flat")
+        self.deals = {}
+        for i, status in enumerate(["DRAFT", "ACTIVE", "ACTIVE", "SUSPENDED", "COMPLETED"]):
+            realty = create_realty(owner, flat, f"Realty {i}", is_in_deal=True)
+            self.deals[i] = Deal.objects.create(deal_type=Deal.DealType.SALE, status=status, realty=realty,
+                                                customer=customer, owner=owner)
+        self.staff = User.objects.create_user(username="staff", password="12345", is_staff=True)
+
+    def statuses(self):
+        return list(Deal.objects.order_by("pk").values_list("status", flat=True))
+
+    def test_transition_applies_allowed_moves_in_one_update(self):
+        with CaptureQueriesContext(connection) as queries:
+            result = deals.transition(Deal.objects.all(), Deal.DealStatus.COMPLETED)
+        self.assertEqual(len([query for query in queries
+                              if query["sql"].startswith(f'UPDATE "{Deal._meta.db_table}"')]), 1)
+        # The deals are selected by the query itself, never by a list of ids
+        self.assertFalse([query for query in queries if f"IN ({self.deals[1].pk}, " in query["sql"]])
+
+        self.assertEqual(result, deals.TransitionResult(
+            changed=2, unchanged=1, rejected={self.deals[0].pk: "DRAFT", self.deals[3].pk: "SUSPENDED"}))
+        self.assertEqual(self.statuses(), ["DRAFT", "COMPLETED", "COMPLETED", "SUSPENDED", "COMPLETED"])
+        self.assertIsNotNone(Deal.objects.get(pk=self.deals[1].pk).closed_at)
+        self.assertEqual(Deal.objects.get(pk=self.deals[1].pk).version, 1)
+        self.assertEqual(rollups.drift(), {})
+
+    def test_cancelling_releases_realty(self):
+        result = deals.transition(Deal.objects.all(), Deal.DealStatus.CANCELLED)
+
+        self.assertEqual(result.changed, 4)
+        self.assertEqual(self.statuses(), ["CANCELLED"] * 4 + ["COMPLETED"])
+        self.assertEqual(list(Realty.objects.order_by("pk").values_list("is_in_deal", flat=True)),
+                         [False] * 4 + [True])
+        self.assertEqual(rollups.count_available_realty(), 4)
+        self.assertEqual(rollups.drift(), {})
+
+    def test_deleting_a_closed_deal_keeps_realty_of_an_open_one(self):
+        cancelled = self.deals[1]
+        deals.transition(Deal.objects.filter(pk=cancelled.pk), Deal.DealStatus.CANCELLED)
+        Realty.objects.filter(pk=cancelled.realty_id).update(is_in_deal=True)
+        reopened = Deal.objects.create(deal_type=Deal.DealType.SALE, realty=cancelled.realty,
+                                       customer=cancelled.customer, owner=cancelled.owner)
+        rollups.rebuild()
+        self.client.force_login(self.staff)
+
+        self.client.post(reverse("deal-delete", args=[cancelled.pk]))
+        self.assertFalse(Deal.objects.filter(pk=cancelled.pk).exists())
+        self.assertTrue(Realty.objects.get(pk=cancelled.realty_id).is_in_deal)
+
+        self.client.post(reverse("deal-delete", args=[reopened.pk]))
+        self.assertFalse(Realty.objects.get(pk=cancelled.realty_id).is_in_deal)
+        self.assertEqual(rollups.drift(), {})
+
+    def test_transition_view_and_command(self):
+        url = reverse("deals-transition")
+        self.client.force_login(User.objects.create_user(username="visitor", password="12345"))
+        self.assertEqual(self.client.post(url, {"deals": [self.deals[0].pk], "status": "ACTIVE"}).status_code, 403)
+
+        self.client.force_login(self.staff)
+        response = self.client.post(url, {"deals": [self.deals[0].pk, self.deals[4].pk], "status": "ACTIVE"},
+                                    follow=True)
+        self.assertContains(response, "1 deals moved to")
+        self.assertContains(response, "1 deals can")
+        self.assertEqual(self.statuses(), ["ACTIVE", "ACTIVE", "ACTIVE", "SUSPENDED", "COMPLETED"])
+
+        out = io.StringIO()
+        call_command("transition_deals", "COMPLETED", "--from", "ACTIVE", stdout=out)
+        self.assertIn("Moved 3 deals to COMPLETED, 0 already there, 0 rejected", out.getvalue())
+        err = io.StringIO()
+        call_command("transition_deals", "CANCELLED", "--ids", str(self.deals[3].pk), str(self.deals[4].pk), "999",
+                     stdout=out, stderr=err)
+        self.assertIn("Moved 1 deals to CANCELLED, 0 already there, 1 rejected", out.getvalue())
+        self.assertIn(f"Deal {self.deals[4].pk}: COMPLETED can't move to CANCELLED", err.getvalue())
+        self.assertIn("Deal 999: does not exist", err.getvalue())
+        with self.assertRaises(CommandError):
+            call_command("transition_deals", "ACTIVE", "--from", "COMPLETED", stdout=out)
+        with self.assertRaises(CommandError):
+            call_command("transition_deals", "COMPLETED", "--from", "ACTIVE", "--created-before", "31.12.2025",
+                         stdout=out)
+
+        yesterday = timezone.localdate() - datetime.timedelta(days=1)
+        Deal.objects.filter(pk=self.deals[0].pk).update(
+            status="DRAFT", created_at=timezone.make_aware(datetime.datetime.combine(yesterday, datetime.time.max)))
+        rollups.rebuild()
+        for created_before, moved in ((yesterday, 0), (timezone.localdate(), 1)):
+            out = io.StringIO()
+            call_command("transition_deals", "ACTIVE", "--from", "DRAFT", "--created-before",
+                         created_before.isoformat(), stdout=out)
+            self.assertIn(f"Moved {moved} deals to ACTIVE", out.getvalue())
+        self.assertEqual(rollups.drift(), {})
+
+
+class DealExportTests(TestCase):
+    def setUp(self):
+        owner = create_owner()
+        customer = create_customer()
+        employee = Employee.objects.create(user=create_profile("employee"))
+        flat = RealtyType.objects.create(name="Flat")
+        self.deals = []
+        for i, (deal_type, status) in enumerate([("SALE", "ACTIVE"), ("RENT", "COMPLETED"), ("SALE", "DRAFT")]):
+            realty = create_realty(owner, flat, f"Realty {i}", is_in_deal=True)
+            self.deals.append(Deal.objects.create(deal_type=deal_type, status=status, realty=realty,
+                                                  customer=customer, owner=owner,
+                                                  employee=employee if i == 0 else None))
+        Deal.objects.filter(pk=self.deals[2].pk).update(created_at=timezone.now() - datetime.timedelta(days=40))
+        self.client.force_login(User.objects.create_user(username="finance", password="12345", is_staff=True))
+
+    def export(self, **params):
+        response = self.client.get(reverse("deals-export"), params)
+        self.assertTrue(response.streaming)
+        return response, b"".join(response.streaming_content).decode()
+
+    def test_csv_export(self):
+        response, content = self.export()
+        self.assertEqual(response["Content-Type"], "text/csv")
+        self.assertIn("attachment", response["Content-Disposition"])
+        lines = content.splitlines()
+        self.assertEqual(lines[0], ",".join(exports.COLUMNS))
+        self.assertEqual(len(lines), 4)
+        first = lines[1].split(",")
+        self.assertEqual(first[:3], [str(self.deals[0].pk), "SALE", "ACTIVE"])
+        self.assertEqual(first[-5:], ["Realty 0", "1000.00", "Owner", "Customer", "Employee"])
+        self.assertEqual(lines[2].split(",")[-1], "")
+
+    def test_filters_and_ndjson(self):
+        response, content = self.export(format="ndjson", deal_type="SALE", status=["ACTIVE", "DRAFT"],
+                                        created_from=(timezone.localdate() - datetime.timedelta(days=7)).isoformat())
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        rows = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual([row["id"] for row in rows], [self.deals[0].pk])
+        self.assertEqual(rows[0]["realty_price"], "1000.00")
+        self.assertIsNone(rows[0]["closed_at"])
+
+        _, content = self.export(created_to=(timezone.localdate() - datetime.timedelta(days=7)).isoformat())
+        self.assertEqual(len(content.splitlines()), 2)
+
+    def test_created_dates_are_whole_days(self):
+        day = timezone.localdate() - datetime.timedelta(days=40)
+        late = timezone.make_aware(datetime.datetime.combine(day, datetime.time(23, 59, 59)))
+        Deal.objects.filter(pk=self.deals[2].pk).update(created_at=late)
+
+        exported = exports.filter_deals(Deal.objects.all(), created_from=day, created_to=day)
+        self.assertEqual(list(exported.values_list("pk", flat=True)), [self.deals[2].pk])
+        self.assertFalse(exports.filter_deals(Deal.objects.all(), created_from=day + datetime.timedelta(days=1),
+                                              created_to=day + datetime.timedelta(days=1)).exists())
+        # created_at is compared as it is, so its index can be used
+        self.assertNotIn("cast_date", str(exported.query))
+
+    def test_export_is_for_staff_with_valid_filters(self):
+        self.assertEqual(self.client.get(reverse("deals-export"), {"status": "LOST"}).status_code, 400)
+        self.client.force_login(User.objects.create_user(username="visitor", password="12345"))
+        self.assertEqual(self.client.get(reverse("deals-export")).status_code, 403)
+
+    def test_export_command(self):
+        out = io.StringIO()
+        call_command("export_deals", "--format", "ndjson", "--status", "COMPLETED", stdout=out)
+        rows = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual([(row["id"], row["deal_type"]) for row in rows], [(self.deals[1].pk, "RENT")])
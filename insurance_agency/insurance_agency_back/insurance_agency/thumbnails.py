@@ -0,0 +1,116 @@
+"""
+Thumbnails of uploaded photos, stored next to the originals:
+"realties/flat.png" gets "realties/flat.list.jpg", "realties/flat.detail.jpg"...
+
+Thumbnails are written to the "derivatives" storage, under names derived
+from the original, so those of content-addressed originals never change.
+They are generated when a photo is saved (see signals.py), lazily by the
+``thumbnail`` template tag for photos that have none yet, and for existing
+media by the ``generate_thumbnails`` command.
+"""
+import io
+import logging
+import os
+from typing import NamedTuple
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import storages
+
+
+logger = logging.getLogger(__name__)
+
+
+class Size(NamedTuple):
+    width: int
+    height: int
+    # Cropped to exactly width x height, otherwise fitted inside it
+    crop: bool = False
+
+
+SIZES = {
+    "list": Size(500, 250),
+    "detail": Size(550, 800),
+    "avatar": Size(250, 250, crop=True),
+}
+
+# Thumbnails each photo field gets, by the sizes its pages show
+FIELD_SIZES = {
+    ("insurance_agency.Realty", "photo"): ["list", "detail"],
+    ("insurance_agency.Employee", "image"): ["avatar"],
+}
+
+JPEG_QUALITY = 85
+
+
+def thumbnail_name(name, size):
+    root, _ = os.path.splitext(name)
+    return f"{root}.{size}.jpg"
+
+
+def render(source, size):
+    """Returns the JPEG bytes of the ``size`` thumbnail of the image in ``source``."""
+    # Pillow is only needed when a thumbnail has to be made
+    from PIL import Image, ImageOps
+
+    width, height, crop = SIZES[size]
+    with Image.open(source) as image:
+        # Phone photos are often stored sideways with an EXIF rotation
+        image = ImageOps.exif_transpose(image)
+        if image.mode != "RGB":
+            background = Image.new("RGB", image.size, "white")
+            image = image.convert("RGBA")
+            background.paste(image, mask=image.getchannel("A"))
+            image = background
+        if crop:
+            image = ImageOps.fit(image, (width, height), Image.Resampling.LANCZOS)
+        else:
+            image.thumbnail((width, height), Image.Resampling.LANCZOS)
+        output = io.BytesIO()
+        image.save(output, "JPEG", quality=JPEG_QUALITY, optimize=True, progressive=True)
+    return output.getvalue()
+
+
+def field_sizes(field_file):
+    return FIELD_SIZES.get((field_file.instance._meta.label, field_file.field.name), list(SIZES))
+
+
+def generate(field_file, sizes=None, force=False):
+    """
+    Makes the missing ``sizes`` thumbnails of ``field_file`` (all of them
+    with ``force``), by default those of its field. Returns the names of the
+    thumbnails made.
+    """
+    if sizes is None:
+        sizes = field_sizes(field_file)
+    storage = storages["derivatives"]
+    made = []
+    for size in sizes:
+        name = thumbnail_name(field_file.name, size)
+        if not force and storage.exists(name):
+            continue
+        with field_file.storage.open(field_file.name, "rb") as source:
+            content = render(source, size)
+        if storage.exists(name):
+            storage.delete(name)
+        saved = storage.save(name, ContentFile(content))
+        made.append(saved)
+        logger.info(f"Generated thumbnail {saved}")
+    return made
+
+
+def thumbnail_url(field_file, size):
+    """
+    URL of the ``size`` thumbnail of ``field_file``, made on first use. Falls
+    back to the original when it can't be read as an image.
+    """
+    if not field_file:
+        return ""
+    storage = storages["derivatives"]
+    name = thumbnail_name(field_file.name, size)
+    try:
+        if not storage.exists(name):
+            generate(field_file, [size])
+    except Exception as error:
+        logger.warning(f"Could not make the {size} thumbnail of {field_file.name}: {error}")
+        return field_file.url
+    return storage.url(name)
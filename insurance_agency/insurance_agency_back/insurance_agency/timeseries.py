@@ -0,0 +1,172 @@
+"""
+Daily deal time series kept in DealDailyStats.
+
+Maintained the same way as the Stats rollups (see rollups.py): signal
+handlers snapshot what a deal contributes to the daily rows before and after
+it changes and apply the difference, so reports never scan the Deal table.
+"""
+import logging
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import F, Sum, Count
+from django.db.models.functions import TruncDate, TruncWeek, TruncMonth
+from django.utils import timezone
+
+from .models import Deal, DealDailyStats
+
+
+logger = logging.getLogger(__name__)
+
+MEASURES = ("opened", "opened_value", "closed", "closed_value")
+
+BUCKETS = {
+    "day": lambda field: F(field),
+    "week": TruncWeek,
+    "month": TruncMonth,
+}
+
+
+def _zero():
+    return [0, Decimal(0), 0, Decimal(0)]
+
+
+def _day(value):
+    # Days are counted in the server time zone, whoever made the change
+    return timezone.localtime(value, timezone.get_default_timezone()).date()
+
+
+# Contributions: {(day, deal type, status): [opened, opened_value, closed, closed_value]}
+
+def deal_contributions(deals):
+    contributions = defaultdict(_zero)
+    for deal in deals:
+        opened = contributions[(_day(deal["created_at"]), deal["deal_type"], deal["status"])]
+        opened[0] += 1
+        opened[1] += deal["price"]
+        if deal["closed_at"] is not None:
+            closed = contributions[(_day(deal["closed_at"]), deal["deal_type"], deal["status"])]
+            closed[2] += 1
+            closed[3] += deal["price"]
+    return contributions
+
+
+def _deals(deals):
+    return deals.values("created_at", "closed_at", "deal_type", "status", price=F("realty__price"))
+
+
+def deal_snapshot(pk):
+    return deal_contributions(_deals(Deal.objects.filter(pk=pk)))
+
+
+def realty_snapshot(pk):
+    # A realty price change moves the value of every deal made on it
+    return deal_contributions(_deals(Deal.objects.filter(realty_id=pk)))
+
+
+def _add(key, delta):
+    day, deal_type, status = key
+    rows = DealDailyStats.objects.filter(day=day, deal_type=deal_type, status=status)
+    if rows.update(**{measure: F(measure) + value for measure, value in zip(MEASURES, delta)}):
+        return
+    _, created = DealDailyStats.objects.get_or_create(day=day, deal_type=deal_type, status=status,
+                                                      defaults=dict(zip(MEASURES, delta)))
+    if not created:
+        _add(key, delta)
+
+
+def apply(old, new):
+    """Moves the daily rows from the ``old`` contributions to the ``new`` ones."""
+    deltas = defaultdict(_zero)
+    for sign, contributions in ((-1, old), (1, new)):
+        for key, measures in contributions.items():
+            for i, value in enumerate(measures):
+                deltas[key][i] += sign * value
+
+    for key, delta in deltas.items():
+        if any(delta):
+            _add(key, delta)
+
+
+def deals_snapshot(deals):
+    """
+    Contributions of all the ``deals`` (a queryset), summed by the database
+    in two grouped queries.
+    """
+    tz = timezone.get_default_timezone()
+    rows = defaultdict(_zero)
+    for date_field, (count_measure, value_measure) in (("created_at", (0, 1)), ("closed_at", (2, 3))):
+        grouped = (deals.filter(**{f"{date_field}__isnull": False}).order_by()
+                   .annotate(day=TruncDate(date_field, tzinfo=tz))
+                   .values_list("day", "deal_type", "status")
+                   .annotate(count=Count("id"), value=Sum("realty__price")))
+        for day, deal_type, status, count, value in grouped:
+            rows[(day, deal_type, status)][count_measure] += count
+            rows[(day, deal_type, status)][value_measure] += value or 0
+    return rows
+
+
+def moved(contributions, status, closed_at=None):
+    """
+    What deals contributing ``contributions`` contribute once moved to
+    ``status``, and closed at ``closed_at`` if given.
+    """
+    rows = defaultdict(_zero)
+    for (day, deal_type, _), (opened, opened_value, _, _) in contributions.items():
+        rows[(day, deal_type, status)][0] += opened
+        rows[(day, deal_type, status)][1] += opened_value
+        if closed_at is not None:
+            closed = rows[(_day(closed_at), deal_type, status)]
+            closed[2] += opened
+            closed[3] += opened_value
+    return rows
+
+
+def compute():
+    """Computes every daily row from scratch, in two grouped queries."""
+    return deals_snapshot(Deal.objects.all())
+
+
+def rebuild():
+    with transaction.atomic():
+        DealDailyStats.objects.all().delete()
+        DealDailyStats.objects.bulk_create(
+            DealDailyStats(day=day, deal_type=deal_type, status=status, **dict(zip(MEASURES, measures)))
+            for (day, deal_type, status), measures in compute().items()
+        )
+    logger.info("Deal time series rebuilt")
+
+
+def drift():
+    """Returns {row name: (stored, expected)} for every daily row that is off."""
+    expected = compute()
+    stored = {(row.day, row.deal_type, row.status): [getattr(row, measure) for measure in MEASURES]
+              for row in DealDailyStats.objects.all()}
+
+    drifted = {}
+    for key in expected.keys() | stored.keys():
+        stored_value = tuple(stored.get(key, _zero()))
+        expected_value = tuple(expected.get(key, _zero()))
+        if stored_value != expected_value:
+            day, deal_type, status = key
+            drifted[f"deal_daily_stats:{day}:{deal_type}:{status}"] = (stored_value, expected_value)
+    return drifted
+
+
+def series(start, end, bucket="day", deal_type=None, status=None):
+    """
+    Deals opened and closed between ``start`` and ``end`` (inclusive dates),
+    summed per ``bucket`` (day, week or month), deal type and status.
+    """
+    # Rows all of whose deals moved elsewhere stay behind as zeros
+    rows = DealDailyStats.objects.filter(day__range=(start, end)).exclude(opened=0, closed=0)
+    if deal_type:
+        rows = rows.filter(deal_type=deal_type)
+    if status:
+        rows = rows.filter(status=status)
+
+    return list(rows.annotate(period=BUCKETS[bucket]("day"))
+                .values("period", "deal_type", "status")
+                .annotate(**{measure: Sum(measure) for measure in MEASURES})
+                .order_by("period", "deal_type", "status"))
@@ -22,6 +22,8 @@ urlpatterns = [
     re_path(r'^deal-update/(?P<pk>\d+)/$', DealUpdateView.as_view(), name="deal-update"),
     re_path(r'^deal-delete/(?P<pk>\d+)/$', DealDeleteView.as_view(), name="deal-delete"),
     path('deals/', views.deals, name="deals"),
+    path('deals/transition/', views.deals_transition, name="deals-transition"),
+    path('deals/export/', views.deals_export, name="deals-export"),
     path('my-deals/', views.my_deals, name="my-deals"),
     re_path(r'^employee-update/(?P<pk>\d+)/$', EmployeeAdminUpdateView.as_view(), name="employee-update"),
     path('employees/', views.employees, name="employees"),
@@ -1,15 +1,25 @@
-from itertools import chain
 import logging
+from django.conf import settings
 from django.contrib import messages
+from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django.core.exceptions import BadRequest, PermissionDenied
+from django.db import transaction
 from django.db.models import Q
+from django.http import StreamingHttpResponse
 from django.shortcuts import redirect, render, get_object_or_404
+from django.utils import timezone
 from django.urls import reverse_lazy
+from django.views.decorators.http import require_POST
 from django.views.generic import CreateView, UpdateView, DeleteView
 
 from .forms import EmployeeForm, CustomerForm, OwnerForm, RealtyForm, DealForm, DealUpdateForm, DealAdminForm, \
-    CustomerAdminForm, EmployeeAdminForm
+    CustomerAdminForm, EmployeeAdminForm, RealtyFilterForm, DealTransitionForm, DealExportForm
 from .models import Employee, UserProfile, Customer, Owner, Realty, Deal
+from . import exports, facets, realty_cache, reservations, rollups, search, sorting
+from .deals import DealConflict, release_realty, save_if_unchanged, transition
+from .pagination import paginate
+from insurance_agency_back.query_budget import query_budget
 
 
 logger = logging.getLogger(__name__)
@@ -86,8 +96,9 @@ class EmployeeAdminCreateView(LoginRequiredMixin, CreateView):
         return super().form_valid(form)
 
 
+@query_budget(queries=5)
 def employees(request):
-    employees = Employee.objects.all()
+    employees = Employee.objects.for_listing()
     return render(request, 'insurance_agency/employees.html',
                   {"employees": employees})
 
@@ -135,8 +146,9 @@ class CustomerAdminUpdateView(LoginRequiredMixin, UpdateView):
     success_url = reverse_lazy('customers')
 
 
+@query_budget(queries=5)
 def customers(request):
-    customers = Customer.objects.all()
+    customers = Customer.objects.for_listing()
     return render(request, 'insurance_agency/customers.html',
                   {"customers": customers})
 
@@ -163,52 +175,67 @@ class OwnerCreateView(LoginRequiredMixin, CreateView):
         return super().form_valid(form)
 
 
+def _page_links(request, page):
+    """Query strings of the first and the next page, keeping the other parameters."""
+    params = request.GET.copy()
+    params.pop("cursor", None)
+    first_page_query = params.urlencode()
+    if page.next_cursor:
+        params["cursor"] = page.next_cursor
+    return {"next_cursor": page.next_cursor,
+            "first_page_query": first_page_query,
+            "next_page_query": params.urlencode()}
+
+
+def _insurances_page(request, insurances, sorts, total=None):
+    """``total`` returns the number of ``insurances``, for when nothing narrows them down."""
+    query = request.GET.get("q", "").strip()
+    if query:
+        insurances = search.search(insurances, query)
+    searching = bool(query) and search.is_available()
+    sort_by, sort = sorting.resolve(sorts, request.GET.get("sort_by"), searching)
+
+    # Invalid filters are shown with their errors and left out
+    filter_form = RealtyFilterForm(request.GET)
+    filter_form.is_valid()
+    insurances = facets.apply_filters(insurances, filter_form.cleaned_data)
+    narrowed = query or any(value not in (None, []) for value in filter_form.cleaned_data.values())
+
+    page = paginate(insurances, sort.ordering, request.GET.get("cursor"),
+                    count=total() if total and not narrowed else None)
+    logger.info(f"Returned realty page with filter '{query}' and sorted by '{sort_by}' ")
+    return {"insurances": page.items,
+            "offers": page.count,
+            **_page_links(request, page),
+            "sort_by": sort_by,
+            "sort_options": sorting.options(sorts, searching),
+            "filter_form": filter_form,
+            "facets": facets.add_links(facets.facet_counts(insurances), request.GET)}
+
+
+@query_budget(queries=8)
 def insurances(request):
-    insurances = Realty.objects.all().order_by('-id').exclude(is_in_deal=True)
-
-    query = request.GET.get("q", "")
-    sort_by = request.GET.get("sort_by", "-id")
-
-    insurances = insurances.filter(
-        Q(type__name__icontains=query)
-    )
-
-    if sort_by:
-        insurances = insurances.order_by(sort_by)
-
-    logger.info(f"Returned queryset with filter '{query}' and sorted by '{sort_by}' ")
+    insurances = Realty.objects.for_listing().exclude(is_in_deal=True)
     return render(request, "insurance_agency/insurances.html",
-                  { "insurances": insurances,
-                            "offers": len(insurances)})
+                  _insurances_page(request, insurances, sorting.CATALOG_SORTS, total=rollups.count_available_realty))
 
 
+@query_budget(queries=10)
 def my_insurances(request):
-    insurances = (Realty.objects.filter(owner=Owner.objects
-                                    .get(user=UserProfile.objects
-                                         .get(user=request.user)))
-               .order_by('-id'))
-
-    query = request.GET.get("q", "")
-    sort_by = request.GET.get("sort_by", "-id")
-
-    insurances = insurances.filter(
-        Q(name__icontains=query)
-    )
-
-    if sort_by:
-        insurances = insurances.order_by(sort_by)
-    logger.info(f"Returned user owned insurances queryset with filter '{query}' and sorted by '{sort_by}' ")
+    insurances = Realty.objects.for_listing().filter(owner=Owner.objects
+                                                         .get(user=UserProfile.objects
+                                                              .get(user=request.user)))
     return render(request, "insurance_agency/insurances.html",
-                  { "insurances": insurances,
-                            "offers": len(insurances)})
+                  _insurances_page(request, insurances, sorting.MY_REALTY_SORTS))
 
 
+@query_budget(queries=4)
 def insurance(request, id):
-    realty = Realty.objects.get(id=id)
+    realty = realty_cache.get_realty(int(id))
 
-    user = UserProfile.objects.get(user=request.user)
-    is_current_owner = True if realty.owner.user == user else False
-    is_customer = True if user.is_customer and not is_current_owner else False
+    user = request.profile
+    is_current_owner = user is not None and realty.owner.user_id == user.id
+    is_customer = user is not None and user.is_customer and not is_current_owner
 
     if request.user.is_superuser:
         is_current_owner = True
@@ -217,7 +244,8 @@ def insurance(request, id):
     return render(request, "insurance_agency/realty.html",
                   { "realty": realty,
                             "is_owner": is_current_owner,
-                            "is_customer": is_customer})
+                            "is_customer": is_customer,
+                            "cache_ttl": settings.REALTY_CACHE_TTL})
 
 
 class RealtyCreateView(LoginRequiredMixin, CreateView):
@@ -259,14 +287,31 @@ class DealCreateView(LoginRequiredMixin, CreateView):
 
     def dispatch(self, request, *args, **kwargs):
         self.realty = get_object_or_404(Realty, pk=kwargs['realty_pk'])
-        self.realty.is_in_deal = True
-        self.realty.save()
         return super().dispatch(request, *args, **kwargs)
 
+    def realty_unavailable(self):
+        messages.error(self.request, "This realty is already in a deal or reserved by another customer.")
+        logger.warning(f"Realty {self.realty} is not available for a deal")
+        return redirect('realty-detail', id=self.realty.pk)
+
+    def get(self, request, *args, **kwargs):
+        # Held for the customer while they fill in the form
+        customer = Customer.objects.filter(user__user=request.user).first()
+        if customer is not None and not reservations.reserve(self.realty.pk, customer):
+            return self.realty_unavailable()
+        return super().get(request, *args, **kwargs)
+
+    @transaction.atomic
     def form_valid(self, form):
         user = UserProfile.objects.get(user=self.request.user)
         customer = get_object_or_404(Customer, user=user)
 
+        # Taken off the catalog together with creating the deal, so the
+        # available realty counters never see one without the other
+        try:
+            reservations.claim(self.realty.pk, customer)
+        except reservations.RealtyUnavailable:
+            return self.realty_unavailable()
         form.instance.customer = customer
         form.instance.realty = self.realty
         form.instance.owner = self.realty.owner
@@ -282,11 +327,15 @@ class DealAdminCreateView(LoginRequiredMixin, CreateView):
     success_url = reverse_lazy('deals')
 
 
+    @transaction.atomic
     def form_valid(self, form):
         realty = form.instance.realty
+        try:
+            reservations.claim(realty.pk, form.instance.customer)
+        except reservations.RealtyUnavailable:
+            form.add_error("realty", "This realty is already in a deal or reserved by another customer.")
+            return self.form_invalid(form)
         form.instance.owner = realty.owner
-        realty.is_in_deal = True
-        realty.save()
         logger.info(f"{form.instance.owner} and {form.instance.customer} make a deal "
                     f"for {form.instance.realty} - {form.instance.realty.price}")
         return super().form_valid(form)
@@ -298,14 +347,18 @@ class DealUpdateView(LoginRequiredMixin, UpdateView):
     template_name = 'form.html'
     success_url = reverse_lazy('deals')
 
-    def dispatch(self, request, *args, **kwargs):
-        self.object = self.get_object()
-
-        employee = getattr(self.object, "employee", None)
-        if employee is None:
-            self.object.employee = Employee.objects.get(user=UserProfile.objects.get(user=request.user))
-            self.object.save()
-        return super().dispatch(request, *args, **kwargs)
+    def form_valid(self, form):
+        # The employee who first handles the deal takes it
+        if self.object.employee_id is None:
+            self.object.employee = Employee.objects.filter(user__user=self.request.user).first()
+        try:
+            save_if_unchanged(self.object, form.cleaned_data["version"])
+        except DealConflict:
+            form.add_error(None, "The deal was changed by someone else while you were editing it. "
+                                 "Reload the page to see their changes.")
+            return self.render_to_response(self.get_context_data(form=form), status=409)
+        logger.info(f"Deal {self.object.pk} updated to version {self.object.version}")
+        return redirect(self.get_success_url())
 
 
 class DealDeleteView(LoginRequiredMixin, DeleteView):
@@ -313,36 +366,85 @@ class DealDeleteView(LoginRequiredMixin, DeleteView):
     template_name = 'confirm_delete.html'
     success_url = reverse_lazy('deals')
 
-    def dispatch(self, request, *args, **kwargs):
-        self.object = self.get_object()
+    @transaction.atomic
+    def form_valid(self, form):
         logger.info(f"Deal {self.object.pk} deleted")
-        realty = getattr(self.object, "realty", None)
-        if realty is not None:
-            realty.is_in_deal = False
-            realty.save()
-        return super().dispatch(request, *args, **kwargs)
-
-
+        was_open = self.object.status not in Deal.CLOSED_STATUSES
+        realty_id = self.object.realty_id
+        response = super().form_valid(form)
+        if was_open and realty_id is not None:
+            release_realty([realty_id])
+        return response
+
+
+@require_POST
+@login_required
+def deals_transition(request):
+    """Moves the selected deals to another status at once."""
+    if not request.user.is_staff:
+        raise PermissionDenied
+    form = DealTransitionForm(request.POST)
+    if not form.is_valid():
+        messages.error(request, "Select the deals and the status to move them to.")
+        return redirect('deals')
+
+    status = form.cleaned_data["status"]
+    result = transition(form.cleaned_data["deals"], status)
+    label = Deal.DealStatus(status).label
+    if result.changed:
+        messages.success(request, f"{result.changed} deals moved to \"{label}\".")
+    if result.unchanged:
+        messages.info(request, f"{result.unchanged} deals were already \"{label}\".")
+    if result.rejected:
+        messages.error(request, f"{len(result.rejected)} deals can't move to \"{label}\": "
+                                f"{', '.join(map(str, result.rejected))}.")
+    return redirect('deals')
+
+
+# No query budget: the rows are read while streaming, after the view returns
+@login_required
+def deals_export(request):
+    """Streams the deals matching the filters as CSV (the default) or NDJSON."""
+    if not request.user.is_staff:
+        raise PermissionDenied
+    form = DealExportForm(request.GET)
+    if not form.is_valid():
+        raise BadRequest(form.errors.as_text())
+
+    filters = form.cleaned_data
+    export_format = filters.pop("format") or "csv"
+    deals = exports.filter_deals(Deal.objects.all(), **filters)
+    logger.info(f"Exporting deals as {export_format} with filters {filters}")
+    response = StreamingHttpResponse(exports.lines(deals, export_format), content_type=exports.FORMATS[export_format])
+    filename = f"deals-{timezone.localdate():%Y-%m-%d}.{export_format}"
+    response["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return response
+
+
+@query_budget(queries=5)
 def deals(request):
-    deals = Deal.objects.all()
+    deals = Deal.objects.for_listing()
     return render(request, "insurance_agency/deals.html",
-                  {"deals": deals})
+                  {"deals": deals,
+                   "statuses": Deal.DealStatus.choices})
 
 
-def my_deals(request):
-    user = UserProfile.objects.get(user=request.user)
-    owner_deals = Deal.objects.none()
-    customer_deals = Deal.objects.none()
+MY_DEALS_SORT = "-created_at"
 
-    if user.is_owner:
-        owner = Owner.objects.get(user=user)
-        owner_deals = Deal.objects.filter(owner=owner)
 
-    if user.is_customer:
-        customer = Customer.objects.get(user=user)
-        customer_deals = Deal.objects.filter(customer=customer)
+def user_deals(profile):
+    """Deals ``profile`` takes part in as the owner or the customer, in one query."""
+    if profile is None:
+        return Deal.objects.none()
+    # Subqueries rather than joins, so both sides can use the deal indexes
+    return Deal.objects.for_listing().filter(
+        Q(owner__in=Owner.objects.filter(user=profile).values("pk"))
+        | Q(customer__in=Customer.objects.filter(user=profile).values("pk")))
 
-    deals = list(chain(owner_deals, customer_deals))
-    logger.info(f"Returned user {user} deals queryset")
+
+@query_budget(queries=4)
+def my_deals(request):
+    page = paginate(user_deals(request.profile), MY_DEALS_SORT, request.GET.get("cursor"), counted=False)
+    logger.info(f"Returned user {request.profile} deals page")
     return render(request, "insurance_agency/deals.html",
-                  {"deals": deals})
\ No newline at end of file
+                  {"deals": page.items, **_page_links(request, page)})
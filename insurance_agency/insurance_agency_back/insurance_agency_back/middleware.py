@@ -1,14 +1,55 @@
+import logging
+
+from django.conf import settings
 from django.utils import timezone
 
+from .query_budget import QueryBudgetExceeded, recording, view_budget
+
+
+logger = logging.getLogger(__name__)
+
+
 class TimezoneMiddleware:
+    """
+    Activates the viewer's time zone. Their profile is loaded for that
+    anyway, so it's kept as ``request.profile`` (None for anonymous
+    visitors and users without one) for views to reuse.
+    """
     def __init__(self, get_response):
         self.get_response = get_response
 
     def __call__(self, request):
         user = request.user
+        request.profile = None
         if user.is_authenticated and hasattr(user, 'userprofile'):
+            request.profile = user.userprofile
             timezone.activate(user.userprofile.time_zone)
         else:
             timezone.deactivate()
 
         return self.get_response(request)
+
+
+class QueryBudgetMiddleware:
+    """
+    Records the queries of every request and checks them against the
+    budget its view declares. Goes first, so the queries of the other
+    middleware count too. Queries run while a streaming response is being
+    sent happen after it returns and aren't counted.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with recording() as recorder:
+            response = self.get_response(request)
+        request.query_stats = recorder
+
+        match = request.resolver_match
+        budget = view_budget(match.func) if match else None
+        problems = recorder.problems(budget) if budget else []
+        if problems and settings.QUERY_BUDGET_ENFORCE:
+            raise QueryBudgetExceeded(f"{request.path}: {'; '.join(problems)}\n{recorder.report()}")
+        if settings.DEBUG and (problems or recorder.duplicates()):
+            logger.warning(f"{request.path}: {'; '.join(problems) or 'repeated queries'}\n{recorder.report()}")
+        return response
@@ -0,0 +1,102 @@
+"""
+Query budgets: how many SQL queries, and how much SQL time, a view may use.
+
+Views declare their budget with the ``query_budget`` decorator (or a
+``query_budget`` attribute on class-based views). QueryBudgetMiddleware
+records every request; over-budget requests and repeated statements (the
+usual sign of an N+1) are logged in development and fail under tests, see
+QUERY_BUDGET_ENFORCE. ``assert_query_budget`` checks any block of code.
+"""
+import logging
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+from typing import NamedTuple
+
+from django.db import connections
+
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class Budget(NamedTuple):
+    queries: int | None = None
+    seconds: float | None = None
+
+
+class QueryRecorder:
+    """execute_wrapper keeping the SQL and duration of every query."""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((sql, time.perf_counter() - started))
+
+    @property
+    def count(self):
+        return len(self.queries)
+
+    @property
+    def seconds(self):
+        return sum(seconds for _, seconds in self.queries)
+
+    def duplicates(self):
+        """{sql: times run} for every statement run more than once, parameters aside."""
+        return {sql: times for sql, times in Counter(sql for sql, _ in self.queries).items() if times > 1}
+
+    def problems(self, budget):
+        problems = []
+        if budget.queries is not None and self.count > budget.queries:
+            problems.append(f"{self.count} queries, budget is {budget.queries}")
+        if budget.seconds is not None and self.seconds > budget.seconds:
+            problems.append(f"{self.seconds:.3f}s of SQL, budget is {budget.seconds:.3f}s")
+        return problems
+
+    def report(self):
+        lines = [f"{self.count} queries in {self.seconds:.3f}s"]
+        for sql, times in sorted(self.duplicates().items(), key=lambda item: -item[1]):
+            lines.append(f"  {times}x {sql}")
+        return "\n".join(lines)
+
+
+@contextmanager
+def recording():
+    recorder = QueryRecorder()
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(recorder))
+        yield recorder
+
+
+def query_budget(queries=None, seconds=None):
+    """Declares the budget of a function-based view."""
+    def decorator(view):
+        view.query_budget = Budget(queries, seconds)
+        return view
+    return decorator
+
+
+def view_budget(view):
+    budget = getattr(view, "query_budget", None)
+    if budget is None:
+        budget = getattr(getattr(view, "view_class", None), "query_budget", None)
+    return budget
+
+
+@contextmanager
+def assert_query_budget(queries=None, seconds=None):
+    """Fails when the block runs more than ``queries`` queries or ``seconds`` of SQL."""
+    with recording() as recorder:
+        yield recorder
+    problems = recorder.problems(Budget(queries, seconds))
+    if problems:
+        raise QueryBudgetExceeded(f"{'; '.join(problems)}\n{recorder.report()}")
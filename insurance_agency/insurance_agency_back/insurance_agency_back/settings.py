@@ -46,6 +46,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'insurance_agency_back.middleware.QueryBudgetMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -76,6 +77,57 @@ TEMPLATES = [
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 MEDIA_URL = '/media/'
 
+# Uploads are stored by content hash, see insurance_agency_back/storage.py.
+# Derivatives (thumbnails) are named after their original instead.
+STORAGES = {
+    'default': {
+        'BACKEND': 'insurance_agency_back.storage.ContentAddressedStorage',
+    },
+    'derivatives': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+}
+
+TESTING = 'test' in sys.argv or 'pytest' in sys.modules
+
+# Cached pages and statistics are dropped by signal handlers in whichever
+# process saved the change, so every worker process has to share the cache:
+# a file cache on this host, next to the SQLite database. Tests keep theirs
+# in memory, so that no run sees another one's entries.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    } if TESTING else {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache',
+    },
+}
+
+# Third-party widgets shown on the home page
+CAT_FACT_URL = "https://catfact.ninja/fact"
+DOG_IMAGE_URL = "https://dog.ceo/api/breeds/image/random"
+# Hard deadline (seconds) for all home page widgets fetched together
+HOME_WIDGETS_TIMEOUT = 1.5
+# Widgets are refreshed in the background once older than TTL (seconds)
+# and replaced with placeholders once older than MAX_STALENESS
+HOME_WIDGETS_TTL = 300
+HOME_WIDGETS_MAX_STALENESS = 60 * 60
+# Cached home page fragments (latest article, calendar), dropped early when articles change
+HOME_FRAGMENTS_TTL = 60 * 60
+
+# Rows per page of the realty listings
+LISTING_PAGE_SIZE = 20
+# Cached realty detail pages, dropped early when the realty or its owner change
+REALTY_CACHE_TTL = 60 * 10
+# How long opening the deal form holds the realty for the customer, in seconds
+REALTY_RESERVATION_TTL = 60 * 15
+
+# Requests over their view's query budget raise instead of only being logged
+QUERY_BUDGET_ENFORCE = TESTING
+
 WSGI_APPLICATION = 'insurance_agency_back.wsgi.application'
 
 
@@ -138,6 +190,11 @@ LOGGING = {
             'level': 'DEBUG',
             'propagate': True,
         },
+        'insurance_agency_back': {
+            'handlers': ['console', 'file'],
+            'level': 'DEBUG',
+            'propagate': True,
+        },
     },
 }
 
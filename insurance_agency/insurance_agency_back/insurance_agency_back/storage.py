@@ -0,0 +1,62 @@
+"""
+Content-addressed media storage.
+
+Uploads are stored under their ``upload_to`` folder by the SHA-256 of their
+content: "realties/3f/3fa1...e9.jpg". Identical uploads share one file, and
+a name never points to other content, so media URLs are served as immutable
+and can be cached for a year (thumbnails of such files are named after them,
+see insurance_agency/thumbnails.py). Files stored under their uploaded names
+before this storage are moved by the ``content_address_media`` command.
+"""
+import hashlib
+import os
+import re
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.views import static
+
+
+HASHED_NAME = re.compile(r"(^|/)(?P<prefix>[0-9a-f]{2})/(?P=prefix)[0-9a-f]{62}\.[^/]+$")
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+
+def is_content_addressed(name):
+    """Whether ``name`` is a content-addressed file, or a derivative of one."""
+    return HASHED_NAME.search(name) is not None
+
+
+def content_hash(content):
+    digest = hashlib.sha256()
+    for chunk in content.chunks():
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    def hashed_name(self, name, content):
+        directory, filename = os.path.split(name)
+        extension = os.path.splitext(filename)[1].lower()
+        digest = content_hash(content)
+        return os.path.join(directory, digest[:2], digest + extension).replace("\\", "/")
+
+    def _save(self, name, content):
+        name = self.hashed_name(name, content)
+        if self.exists(name):
+            return name
+        saved = super()._save(name, content)
+        if saved != name:
+            # The same content was saved concurrently under this name
+            self.delete(saved)
+        return name
+
+
+def serve(request, path, document_root=None, show_indexes=False):
+    """
+    django.views.static.serve, with far-future caching of content-addressed
+    files. Serves MEDIA_ROOT by default.
+    """
+    response = static.serve(request, path, document_root or settings.MEDIA_ROOT, show_indexes)
+    if response.status_code == 200 and is_content_addressed(path):
+        response["Cache-Control"] = f"public, max-age={IMMUTABLE_MAX_AGE}, immutable"
+    return response
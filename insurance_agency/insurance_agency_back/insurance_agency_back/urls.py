@@ -19,6 +19,8 @@ from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
 
+from .storage import serve
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('insurance_agency/', include('insurance_agency.urls')),
@@ -26,4 +28,4 @@ urlpatterns = [
     path('reviews/', include('reviews.urls')),
     path('promocodes/', include('promocodes.urls')),
     path('', include('site_manager.urls'))
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+] + static(settings.MEDIA_URL, view=serve)
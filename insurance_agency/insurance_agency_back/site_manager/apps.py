@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class SiteManagerConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'site_manager'
+
+    def ready(self):
+        from . import signals
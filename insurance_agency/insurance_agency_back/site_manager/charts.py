@@ -0,0 +1,111 @@
+import glob
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+
+from django.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+CHARTS_DIR = "stats"
+# Superseded charts are kept for a while so that pages rendered just before
+# the data changed don't end up with broken images.
+STALE_CHART_LIFETIME = 60 * 60
+
+
+def draw_employees_chart(figure, stats):
+    names = [name for name, _ in stats]
+    counts = [count for _, count in stats]
+
+    axes = figure.subplots()
+    axes.bar(names, counts, color="skyblue")
+    axes.set_title("Количество сделок по сотрудникам")
+    axes.set_xlabel("Сотрудник")
+    axes.set_ylabel("Количество сделок")
+    axes.tick_params(axis="x", labelrotation=45)
+
+
+def draw_realty_chart(figure, stats):
+    types = [name for name, _ in stats]
+    counts = [count for _, count in stats]
+
+    axes = figure.subplots()
+    axes.pie(counts, labels=types, autopct='%1.1f%%', startangle=140)
+    axes.set_title('Распределение недвижимости по типам')
+    axes.axis('equal')
+
+
+CHARTS = {
+    "employees_sales_stats": ((10, 6), draw_employees_chart),
+    "realty_pie_chart": ((8, 8), draw_realty_chart),
+}
+
+
+def chart_name(chart, stats):
+    """Media-relative file name of ``chart`` drawn from ``stats``."""
+    payload = json.dumps([chart, stats], default=str, sort_keys=True)
+    digest = hashlib.sha256(payload.encode()).hexdigest()[:16]
+    return f"{CHARTS_DIR}/{chart}-{digest}.png"
+
+
+def render_chart(chart, stats, path):
+    # matplotlib takes about half a second to import, only pay for it when
+    # a chart actually has to be drawn.
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    figsize, draw = CHARTS[chart]
+    figure = Figure(figsize=figsize)
+    FigureCanvasAgg(figure)
+    draw(figure, stats)
+    figure.tight_layout()
+
+    # Render next to the target and rename, so concurrent readers and writers
+    # only ever see a complete file.
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".png.tmp")
+    try:
+        with os.fdopen(fd, "wb") as tmp_file:
+            figure.savefig(tmp_file, format="png")
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    logger.info(f"Rendered chart {path}")
+
+
+def prune_charts(chart, keep):
+    expire_before = time.time() - STALE_CHART_LIFETIME
+    for path in glob.glob(os.path.join(settings.MEDIA_ROOT, CHARTS_DIR, f"{chart}-*.png")):
+        if path != keep and os.path.getmtime(path) < expire_before:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def chart_url(chart, stats):
+    """
+    Returns the URL of ``chart`` drawn from ``stats``.
+
+    File names are derived from the data, so a chart is only drawn the first
+    time its data is seen and then served as a plain media file.
+    """
+    name = chart_name(chart, stats)
+    path = os.path.join(settings.MEDIA_ROOT, name)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        render_chart(chart, stats, path)
+        prune_charts(chart, keep=path)
+    return settings.MEDIA_URL + name
+
+
+def employees_chart_url(stats):
+    return chart_url("employees_sales_stats", stats)
+
+
+def realty_chart_url(stats):
+    return chart_url("realty_pie_chart", stats)
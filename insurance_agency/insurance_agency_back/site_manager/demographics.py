@@ -0,0 +1,112 @@
+import datetime
+import math
+
+from django.core.cache import cache
+from django.db.models import Case, Count, IntegerField, Q, Value, When
+from django.db.models.functions import ExtractYear
+from django.utils import timezone
+
+from insurance_agency.models import Customer, Employee, Owner
+
+
+ROLES = {
+    "customer": Customer,
+    "employee": Employee,
+    "owner": Owner,
+}
+
+PERCENTILES = (10, 25, 50, 75, 90)
+
+# [lower, upper) age bounds, None means unbounded
+AGE_BUCKETS = ((None, 25), (25, 35), (35, 45), (45, 55), (55, 65), (65, None))
+
+
+def age_expression(today):
+    """Exact age in full years on ``today``, computed by the database."""
+    had_birthday = (Q(user__birth_day__month__lt=today.month)
+                    | Q(user__birth_day__month=today.month, user__birth_day__day__lte=today.day))
+    return (Value(today.year) - ExtractYear("user__birth_day")
+            - Case(When(had_birthday, then=Value(0)), default=Value(1), output_field=IntegerField()))
+
+
+def age_distribution(people, today):
+    """Returns [(age, number of people)] sorted by age, grouped in one query."""
+    return list(people.filter(user__isnull=False)
+                .annotate(age=age_expression(today))
+                .values_list("age")
+                .annotate(count=Count("id"))
+                .order_by("age"))
+
+
+def _age_at(distribution, index):
+    seen = 0
+    for age, count in distribution:
+        seen += count
+        if index < seen:
+            return age
+    raise IndexError(index)
+
+
+def percentile(distribution, total, p):
+    # Linear interpolation between closest ranks, like statistics.quantiles(method="inclusive")
+    position = (total - 1) * p / 100
+    lower, upper = math.floor(position), math.ceil(position)
+    lower_age, upper_age = _age_at(distribution, lower), _age_at(distribution, upper)
+    return lower_age + (upper_age - lower_age) * (position - lower)
+
+
+def bucket_label(lower, upper):
+    if lower is None:
+        return f"<{upper}"
+    if upper is None:
+        return f"{lower}+"
+    return f"{lower}-{upper - 1}"
+
+
+def describe(distribution):
+    total = sum(count for _, count in distribution)
+    histogram = [
+        {"bucket": bucket_label(lower, upper),
+         "count": sum(count for age, count in distribution
+                      if (lower is None or age >= lower) and (upper is None or age < upper))}
+        for lower, upper in AGE_BUCKETS
+    ]
+    if not total:
+        return {"count": 0, "mean": None, "median": None,
+                "percentiles": {str(p): None for p in PERCENTILES}, "histogram": histogram}
+
+    return {
+        "count": total,
+        "mean": round(sum(age * count for age, count in distribution) / total, 3),
+        "median": percentile(distribution, total, 50),
+        "percentiles": {str(p): percentile(distribution, total, p) for p in PERCENTILES},
+        "histogram": histogram,
+    }
+
+
+def compute_demographics(today):
+    return {
+        "date": today.isoformat(),
+        "roles": {role: describe(age_distribution(model.objects.all(), today)) for role, model in ROLES.items()},
+    }
+
+
+def cache_key(today):
+    return f"demographics:{today.isoformat()}"
+
+
+def get_demographics():
+    """
+    Age statistics per role, cached until midnight: ages only change when
+    the date does, and the cache is dropped whenever people change.
+    """
+    # Server time, not the visitor's: there is one cache entry per day
+    now = timezone.localtime(timezone=timezone.get_default_timezone())
+    today = now.date()
+    midnight = datetime.datetime.combine(today + datetime.timedelta(days=1), datetime.time(), tzinfo=now.tzinfo)
+    timeout = max(int((midnight - now).total_seconds()), 1)
+    return cache.get_or_set(cache_key(today), lambda: compute_demographics(today), timeout)
+
+
+def invalidate_demographics():
+    cache.delete(cache_key(timezone.localdate(timezone=timezone.get_default_timezone())))
@@ -0,0 +1,38 @@
+import calendar
+
+from django.conf import settings
+from django.core.cache import cache
+
+from articles.models import Article
+
+
+ARTICLE_KEY = "home:article"
+
+
+def calendar_key(year, month):
+    return f"home:calendar:{year}-{month:02d}"
+
+
+def home_fragments(local_now):
+    """
+    The latest article and the text calendar of the visitor's current month,
+    fetched from the cache in one lookup.
+    """
+    key = calendar_key(local_now.year, local_now.month)
+    cached = cache.get_many([ARTICLE_KEY, key])
+
+    missing = {}
+    if ARTICLE_KEY not in cached:
+        # "" marks that there are no articles, so that isn't queried either
+        missing[ARTICLE_KEY] = Article.objects.last() or ""
+    if key not in cached:
+        missing[key] = calendar.TextCalendar().formatmonth(local_now.year, local_now.month)
+    if missing:
+        cache.set_many(missing, settings.HOME_FRAGMENTS_TTL)
+        cached.update(missing)
+
+    return {"article": cached[ARTICLE_KEY], "text_calendar": cached[key]}
+
+
+def invalidate_article():
+    cache.delete(ARTICLE_KEY)
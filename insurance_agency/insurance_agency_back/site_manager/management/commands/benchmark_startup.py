@@ -0,0 +1,74 @@
+import json
+import re
+import statistics
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+
+# Runs in a fresh interpreter: what every worker and every manage.py call pays
+STARTUP_SCRIPT = """
+import json, os, sys, time
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "insurance_agency_back.settings")
+started = time.perf_counter()
+import django
+django.setup()
+from django.urls import get_resolver
+get_resolver().url_patterns
+print(json.dumps({"seconds": time.perf_counter() - started, "modules": sorted(sys.modules)}))
+"""
+
+IMPORT_TIME_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+HEAVY_MODULES = ["matplotlib", "numpy", "PIL", "requests"]
+
+
+def measure_startup():
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", STARTUP_SCRIPT],
+                            cwd=settings.BASE_DIR, capture_output=True, text=True, check=True)
+    startup = json.loads(result.stdout.strip().splitlines()[-1])
+
+    imports = {}
+    for line in result.stderr.splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+        if match:
+            _, cumulative, indent, module = match.groups()
+            imports[module] = (int(cumulative), len(indent) == 1)
+    startup["import_seconds"] = sum(cumulative for cumulative, top_level in imports.values() if top_level) / 1e6
+    startup["imports"] = imports
+    return startup
+
+
+class Command(BaseCommand):
+    help = "Measures django.setup() plus URLconf loading in a fresh interpreter (python -X importtime)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--runs", type=int, default=5, help="Number of interpreter starts to measure")
+        parser.add_argument("--top", type=int, default=10, help="Number of slowest imports to list")
+        parser.add_argument("--json", action="store_true", help="Print one JSON object, for tracking over releases")
+
+    def handle(self, *args, **options):
+        runs = [measure_startup() for _ in range(options["runs"])]
+        last = runs[-1]
+        slowest = sorted(last["imports"].items(), key=lambda item: item[1][0], reverse=True)[:options["top"]]
+        report = {
+            "runs": len(runs),
+            "setup_seconds_median": statistics.median(run["seconds"] for run in runs),
+            "import_seconds_median": statistics.median(run["import_seconds"] for run in runs),
+            "heavy_modules_loaded": [module for module in HEAVY_MODULES if module in last["modules"]],
+            "slowest_imports": {module: cumulative / 1e6 for module, (cumulative, _) in slowest},
+        }
+
+        if options["json"]:
+            self.stdout.write(json.dumps(report))
+            return
+
+        self.stdout.write(f"django.setup() + URLconf, median of {report['runs']} runs: "
+                          f"{report['setup_seconds_median']:.3f}s "
+                          f"(imports {report['import_seconds_median']:.3f}s)")
+        self.stdout.write(f"Heavy modules loaded: {', '.join(report['heavy_modules_loaded']) or 'none'}")
+        self.stdout.write("Slowest imports (cumulative):")
+        for module, seconds in report["slowest_imports"].items():
+            self.stdout.write(f"  {seconds:8.4f}s  {module}")
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+
+from insurance_agency.benchmarks import benchmark_database, measure, seed
+from insurance_agency.models import Deal, Realty, Customer, Employee, Owner
+from site_manager.stats import (deals_total_value, deals_per_employee, realty_per_type, average_age,
+                                get_deals_count)
+
+
+class Command(BaseCommand):
+    help = "Benchmarks the statistics aggregations on a throwaway database"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", nargs="+", type=int, default=[10_000, 100_000, 1_000_000],
+                            help="Numbers of deals to benchmark with")
+        parser.add_argument("--legacy", action="store_true",
+                            help="Also time the old row-by-row deals sum (one query per deal)")
+
+    def handle(self, *args, **options):
+        metrics = {
+            "deals_total_value": lambda: deals_total_value(Deal.objects.all()),
+            "deals_per_employee": lambda: deals_per_employee(Deal.objects.all()),
+            "realty_per_type": lambda: realty_per_type(Realty.objects.all()),
+            "average_age": lambda: [average_age(model.objects.all()) for model in (Customer, Employee, Owner)],
+        }
+        if options["legacy"]:
+            metrics["legacy_deals_sum"] = lambda: get_deals_count(Deal.objects.all().iterator())
+
+        self.stdout.write(f"{'deals':>10} {'metric':<20} {'seconds':>10} {'queries':>8}")
+        for size in options["sizes"]:
+            with benchmark_database():
+                seed(size)
+                for name, metric in metrics.items():
+                    seconds, queries = measure(metric, repeat=1 if name.startswith("legacy") else 3)
+                    self.stdout.write(f"{size:>10} {name:<20} {seconds:>10.4f} {queries:>8}")
@@ -1,7 +1,7 @@
 from django.db import models
 from django.core.validators import RegexValidator
 
-from insurance_agency.models import TypeOfWork, Employee
+from insurance_agency.models import TypeOfWork, Employee, ListingQuerySet
 
 
 phone_num_validator = RegexValidator(r"^\+375(:?33|29|25|44)\d{7}$")
@@ -62,10 +62,16 @@ class FAQ(models.Model):
                 f"A: {self.answer}")
 
 
+class ContactsQuerySet(ListingQuerySet):
+    listing_related = ("employee__user", "employee__work_type")
+
+
 class Contacts(models.Model):
     employee = models.OneToOneField(Employee, on_delete=models.CASCADE)
     work_description = models.TextField(max_length=500, null=True, blank=True)
 
+    objects = ContactsQuerySet.as_manager()
+
     class Meta:
         verbose_name = "Contacts"
         verbose_name_plural = "Contacts"
@@ -0,0 +1,23 @@
+from django.db.models.signals import post_save, post_delete
+
+from articles.models import Article
+from insurance_agency.models import Customer, Employee, Owner, UserProfile
+from .demographics import invalidate_demographics
+from .fragments import invalidate_article
+
+
+def drop_demographics(sender, **kwargs):
+    invalidate_demographics()
+
+
+for model in (Customer, Employee, Owner, UserProfile):
+    post_save.connect(drop_demographics, sender=model)
+    post_delete.connect(drop_demographics, sender=model)
+
+
+def drop_home_article(sender, **kwargs):
+    invalidate_article()
+
+
+post_save.connect(drop_home_article, sender=Article)
+post_delete.connect(drop_home_article, sender=Article)
@@ -1,47 +1,52 @@
 import datetime
-import os
-import sys
-
-import django
 import statistics
 
-from django.db.models import QuerySet
-from matplotlib import pyplot as plt
+from django.db.models import QuerySet, Sum, Count, Avg
+from django.db.models.functions import ExtractYear
 
-BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-sys.path.append(BASE_DIR)
+from insurance_agency.models import Realty, Deal
+from .charts import employees_chart_url, realty_chart_url
 
-os.environ.setdefault("DJANGO_SETTINGS_MODULE", "insurance_agency_back.settings")
-django.setup()
 
-from insurance_agency.models import UserProfile, Realty, Deal
+# Aggregations below run entirely in the database, each in a single query
+# regardless of the number of rows.
 
+def deals_total_value(deals: QuerySet[Deal]):
+    return deals.aggregate(total=Sum("realty__price"))["total"] or 0
 
 
-def get_employees_stats(deals: QuerySet[Deal]):
-    deal_counts = {}
+def deals_per_employee(deals: QuerySet[Deal]):
+    rows = (deals.filter(employee__isnull=False)
+            .values("employee", "employee__user__full_name")
+            .annotate(deals_count=Count("id"))
+            .order_by("employee"))
+    return [(row["employee__user__full_name"], row["deals_count"]) for row in rows]
 
-    for deal in deals:
-        if deal.employee:
-            deal_counts[deal.employee] = deal_counts.get(deal.employee, 0) + 1
 
-    names = [emp.user.full_name for emp in deal_counts.keys()]
-    counts = list(deal_counts.values())
+def realty_per_type(insurances: QuerySet[Realty]):
+    rows = (insurances.values("type", "type__name")
+            .annotate(realty_count=Count("id"))
+            .order_by("type"))
+    return [(row["type__name"], row["realty_count"]) for row in rows]
 
-    plt.figure(figsize=(10, 6))
-    plt.bar(names, counts, color="skyblue")
-    plt.title("Количество сделок по сотрудникам")
-    plt.xlabel("Сотрудник")
-    plt.ylabel("Количество сделок")
-    plt.xticks(rotation=45)
 
-    plt.tight_layout()
-    plt.savefig(os.path.join(BASE_DIR, "media\\", "stats\\employees_sales_stats.png"))
-    plt.show()
-    plt.close()
+def average_age(peoples: QuerySet):
+    current_year = datetime.date.today().year
+    average_birth_year = (peoples
+                          .filter(user__birth_day__year__lte=current_year)
+                          .aggregate(year=Avg(ExtractYear("user__birth_day")))["year"])
+    if average_birth_year is None:
+        raise statistics.StatisticsError("No valid birth dates to calculate average age.")
+    return current_year - average_birth_year
+
+
+def get_employees_stats(deals: QuerySet[Deal]):
+    return employees_chart_url(deals_per_employee(deals))
 
 
 def get_deals_count(deals: QuerySet[Deal]):
+    if isinstance(deals, QuerySet):
+        return deals_total_value(deals)
     return sum(
         deal.realty.price
         for deal in deals
@@ -50,6 +55,8 @@ def get_deals_count(deals: QuerySet[Deal]):
 
 
 def get_average_age(peoples):
+    if isinstance(peoples, QuerySet):
+        return average_age(peoples)
     ages = []
     current_year = datetime.date.today().year
     for profile in peoples:
@@ -62,20 +69,4 @@ def get_average_age(peoples):
 
 
 def get_realty_stats(insurances: QuerySet[Realty]):
-    realty_counts = {}
-
-    for realty in insurances:
-        if realty.type:
-            realty_counts[realty.type] = realty_counts.get(realty.type, 0) + 1
-
-    types = [type.name for type in realty_counts.keys()]
-    counts = list(realty_counts.values())
-
-    plt.figure(figsize=(8, 8))
-    plt.pie(counts, labels=types, autopct='%1.1f%%', startangle=140)
-    plt.title('Распределение недвижимости по типам')
-    plt.axis('equal')
-    plt.tight_layout()
-    plt.savefig(os.path.join(BASE_DIR, "media\\", "stats\\realty_pie_chart.png"))
-    plt.show()
-    plt.close()
+    return realty_chart_url(realty_per_type(insurances))
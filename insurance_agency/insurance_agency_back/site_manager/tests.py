@@ -1,9 +1,37 @@
 import datetime
+import json
+import os
+import shutil
 import statistics
+import tempfile
+import threading
+import time
 import unittest
-from unittest.mock import MagicMock
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import MagicMock, patch
+from zoneinfo import ZoneInfo
 
-from site_manager.stats import get_average_age, get_deals_count
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.conf import settings
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from articles.models import Article
+from insurance_agency.models import (UserProfile, Owner, Customer, Employee, RealtyType, Realty, Deal,
+                                     TypeOfWork)
+from site_manager.stats import (get_average_age, get_deals_count, deals_total_value, deals_per_employee,
+                                realty_per_type)
+from site_manager import charts
+from site_manager.charts import chart_url
+from site_manager.demographics import compute_demographics
+from site_manager.models import Contacts
+from site_manager.fragments import home_fragments
+from site_manager.management.commands.benchmark_startup import measure_startup
+from site_manager.widgets import get_home_widgets, WIDGETS, NO_CAT_FACT, NO_DOG_PICTURE
 
 
 # Create your tests here.
@@ -73,3 +101,393 @@ class TestGetAverageAge(unittest.TestCase):
     def test_empty_peoples_raises(self):
         with self.assertRaises(statistics.StatisticsError):
             get_average_age([])
+
+
+class StatsDataMixin:
+
+    @classmethod
+    def create_profile(cls, username, full_name, birth_day):
+        user = get_user_model().objects.create_user(username=username, password="pass1234")
+        return UserProfile.objects.create(user=user, full_name=full_name, email=f"{username}@example.com",
+                                          birth_day=birth_day)
+
+    @classmethod
+    def setUpTestData(cls):
+        year = datetime.date.today().year
+        cls.owner = Owner.objects.create(user=cls.create_profile("owner", "Owner", datetime.date(year - 50, 1, 1)))
+        cls.customer = Customer.objects.create(
+            user=cls.create_profile("customer", "Customer", datetime.date(year - 20, 1, 1)))
+        work_type = TypeOfWork.objects.create(name="Agent")
+        cls.employee1 = Employee.objects.create(
+            user=cls.create_profile("employee1", "Employee One", datetime.date(year - 30, 6, 1)),
+            work_type=work_type)
+        cls.employee2 = Employee.objects.create(
+            user=cls.create_profile("employee2", "Employee Two", datetime.date(year - 40, 6, 1)),
+            work_type=work_type)
+
+        cls.flat = RealtyType.objects.create(name="Flat")
+        cls.house = RealtyType.objects.create(name="House")
+        cls.realties = [
+            Realty.objects.create(type=realty_type, owner=cls.owner, name=f"Realty {i}", address="Street",
+                                  price=Decimal(price), area=Decimal("50.00"), built_year=2000)
+            for i, (realty_type, price) in enumerate([(cls.flat, "100000.00"), (cls.flat, "50000.00"),
+                                                      (cls.house, "250000.00")])
+        ]
+        for realty, employee in zip(cls.realties, [cls.employee1, cls.employee1, None]):
+            Deal.objects.create(deal_type=Deal.DealType.SALE, status=Deal.DealStatus.COMPLETED, realty=realty,
+                                customer=cls.customer, owner=cls.owner, employee=employee)
+
+
+class TestStatsAggregations(StatsDataMixin, TestCase):
+
+    def test_deals_total_value(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(deals_total_value(Deal.objects.all()), Decimal("400000.00"))
+        self.assertEqual(get_deals_count(Deal.objects.all()), Decimal("400000.00"))
+
+    def test_deals_total_value_without_deals(self):
+        self.assertEqual(get_deals_count(Deal.objects.none()), 0)
+
+    def test_deals_per_employee(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(deals_per_employee(Deal.objects.all()), [("Employee One", 2)])
+
+    def test_realty_per_type(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(realty_per_type(Realty.objects.all()), [("Flat", 2), ("House", 1)])
+
+    def test_average_age(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(get_average_age(Employee.objects.all()), 35)
+        self.assertEqual(get_average_age(Customer.objects.all()), 20)
+
+    def test_average_age_without_people_raises(self):
+        with self.assertRaises(statistics.StatisticsError):
+            get_average_age(Employee.objects.none())
+
+
+class TempMediaMixin:
+
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        media_settings = override_settings(MEDIA_ROOT=media_root)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+    def media_path(self, url):
+        return os.path.join(settings.MEDIA_ROOT, url[len(settings.MEDIA_URL):])
+
+
+class TestCharts(TempMediaMixin, SimpleTestCase):
+
+    def test_chart_is_rendered_once_per_data(self):
+        with patch.object(charts, "render_chart", wraps=charts.render_chart) as render:
+            url = chart_url("employees_sales_stats", [("Employee One", 2)])
+            self.assertEqual(chart_url("employees_sales_stats", [("Employee One", 2)]), url)
+
+        render.assert_called_once()
+        self.assertTrue(url.startswith(settings.MEDIA_URL + "stats/employees_sales_stats-"))
+        with open(self.media_path(url), "rb") as chart:
+            self.assertEqual(chart.read(8), b"\x89PNG\r\n\x1a\n")
+
+    def test_changed_data_gets_new_chart(self):
+        url = chart_url("realty_pie_chart", [("Flat", 2), ("House", 1)])
+        new_url = chart_url("realty_pie_chart", [("Flat", 3), ("House", 1)])
+
+        self.assertNotEqual(url, new_url)
+        self.assertTrue(os.path.exists(self.media_path(url)))
+        self.assertTrue(os.path.exists(self.media_path(new_url)))
+
+
+class TestStatisticsView(StatsDataMixin, TempMediaMixin, TestCase):
+
+    def test_statistics_page_links_current_charts(self):
+        response = self.client.get(reverse("statistics"))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context["deals_count"], Decimal("400000.00"))
+        for picture in ("employees_stats_picture", "realty_stats_picture"):
+            self.assertTrue(os.path.exists(self.media_path(response.context[picture])))
+
+
+class TestStatisticsApi(StatsDataMixin, TestCase):
+
+    def test_metrics(self):
+        response = self.client.get(reverse("statistics-api"))
+
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(Decimal(data["deals_total_value"]), Decimal("400000.00"))
+        self.assertEqual(data["deals_per_employee"], [{"employee": "Employee One", "deals": 2}])
+        self.assertEqual(set(data["average_age"]), {"customer", "employee", "owner"})
+
+    def test_unchanged_data_is_not_modified(self):
+        url = reverse("statistics-api")
+        etag = self.client.get(url)["ETag"]
+
+        with patch("site_manager.views.rollups.read") as read, self.assertNumQueries(2):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        read.assert_not_called()
+
+    def test_data_change_changes_etag(self):
+        url = reverse("statistics-api")
+        etag = self.client.get(url)["ETag"]
+
+        realty = self.realties[0]
+        realty.price = Decimal("300000.00")
+        realty.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(Decimal(response.json()["deals_total_value"]), Decimal("600000.00"))
+
+
+class TestContacts(TestCase):
+
+    def test_contacts_do_not_query_per_employee(self):
+        work_type = TypeOfWork.objects.create(name="Agent")
+        for i in range(5):
+            employee = Employee.objects.create(
+                user=StatsDataMixin.create_profile(f"employee{i}", f"Employee {i}", datetime.date(1990, 1, 1)),
+                work_type=work_type)
+            Contacts.objects.create(employee=employee, work_description="Sales")
+
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse("contacts"))
+        self.assertContains(response, "Employee 4")
+        self.assertContains(response, "Agent", count=5)
+
+
+class TestStartup(SimpleTestCase):
+
+    def test_startup_does_not_import_plotting(self):
+        startup = measure_startup()
+
+        self.assertIn("site_manager.views", startup["modules"])
+        self.assertNotIn("matplotlib", startup["modules"])
+        self.assertGreater(startup["import_seconds"], 0)
+
+
+class TestDealsTimeSeriesView(StatsDataMixin, TestCase):
+
+    def test_monthly_series(self):
+        today = datetime.date.today()
+        response = self.client.get(reverse("statistics-deals"),
+                                   {"start": today.replace(day=1).isoformat(), "end": today.isoformat(),
+                                    "bucket": "month"})
+
+        self.assertEqual(response.status_code, 200)
+        series = response.json()["series"]
+        self.assertEqual(len(series), 1)
+        self.assertEqual(series[0]["period"], today.replace(day=1).isoformat())
+        self.assertEqual((series[0]["deal_type"], series[0]["status"]), ("SALE", "COMPLETED"))
+        self.assertEqual((series[0]["opened"], series[0]["closed"]), (3, 3))
+        self.assertEqual(Decimal(series[0]["closed_value"]), Decimal("400000.00"))
+
+    def test_series_is_answered_from_rollups(self):
+        url = reverse("statistics-deals")
+        self.client.get(url)
+        with self.assertNumQueries(2):
+            self.client.get(url, {"status": "COMPLETED"})
+
+    def test_invalid_parameters(self):
+        url = reverse("statistics-deals")
+        self.assertEqual(self.client.get(url, {"start": "yesterday"}).status_code, 400)
+        self.assertEqual(self.client.get(url, {"bucket": "year"}).status_code, 400)
+        self.assertEqual(self.client.get(url, {"status": "LOST"}).status_code, 400)
+
+
+class TestHomeFragments(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def create_article(self, title):
+        return Article.objects.create(title=title, short_content="Short", content="Content")
+
+    def test_fragments_are_cached_until_an_article_changes(self):
+        local_now = timezone.localtime()
+        self.assertEqual(home_fragments(local_now)["article"], "")
+        with self.assertNumQueries(0):
+            home_fragments(local_now)
+
+        article = self.create_article("First")
+        self.assertEqual(home_fragments(local_now)["article"], article)
+        article.title = "Renamed"
+        article.save()
+        self.assertEqual(home_fragments(local_now)["article"].title, "Renamed")
+        article.delete()
+        self.assertEqual(home_fragments(local_now)["article"], "")
+
+    def test_calendar_follows_visitor_month(self):
+        moment = datetime.datetime(2024, 1, 31, 23, 30, tzinfo=datetime.timezone.utc)
+        utc_calendar = home_fragments(timezone.localtime(moment, datetime.timezone.utc))["text_calendar"]
+        minsk_calendar = home_fragments(timezone.localtime(moment, ZoneInfo("Europe/Minsk")))["text_calendar"]
+
+        self.assertIn("January 2024", utc_calendar)
+        self.assertIn("February 2024", minsk_calendar)
+
+    @patch("site_manager.views.get_home_widgets",
+           return_value={"cat_fact": NO_CAT_FACT, "dog_image_url": NO_DOG_PICTURE})
+    def test_warm_home_page_does_not_query(self, _):
+        self.create_article("Cached article")
+        self.client.get(reverse("home"))
+
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse("home"))
+        self.assertContains(response, "Cached article")
+
+
+class TestDemographics(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def add_customer(self, username, birth_day):
+        return Customer.objects.create(user=StatsDataMixin.create_profile(username, username, birth_day))
+
+    def test_exact_ages_and_distribution(self):
+        today = datetime.date(2026, 3, 15)
+        self.add_customer("before_birthday", datetime.date(2000, 3, 16))
+        self.add_customer("on_birthday", datetime.date(2000, 3, 15))
+        self.add_customer("older", datetime.date(1980, 1, 1))
+
+        with self.assertNumQueries(3):
+            customers = compute_demographics(today)["roles"]["customer"]
+
+        self.assertEqual(customers["count"], 3)
+        self.assertEqual(customers["mean"], 32.333)
+        self.assertEqual(customers["median"], 26)
+        self.assertEqual(customers["percentiles"]["25"], 25.5)
+        self.assertEqual(customers["percentiles"]["90"], 42)
+        histogram = {bucket["bucket"]: bucket["count"] for bucket in customers["histogram"]}
+        self.assertEqual(histogram, {"<25": 0, "25-34": 2, "35-44": 0, "45-54": 1, "55-64": 0, "65+": 0})
+
+    def test_role_without_people(self):
+        customers = compute_demographics(datetime.date.today())["roles"]["customer"]
+        self.assertEqual(customers["count"], 0)
+        self.assertIsNone(customers["median"])
+
+    def test_demographics_endpoint_is_cached_until_people_change(self):
+        url = reverse("statistics-demographics")
+        self.add_customer("customer", datetime.date(1990, 1, 1))
+        self.assertEqual(self.client.get(url).json()["roles"]["customer"]["count"], 1)
+        with self.assertNumQueries(0):
+            self.client.get(url)
+
+        self.add_customer("new_customer", datetime.date(1990, 1, 1))
+
+        self.assertEqual(self.client.get(url).json()["roles"]["customer"]["count"], 2)
+
+
+class StubWidgetsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        time.sleep(server.delay)
+        if server.status != 200:
+            self.send_response(server.status)
+            self.end_headers()
+            return
+        body = {"fact": server.fact} if self.path == "/fact" else {"message": server.dog}
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(json.dumps(body).encode())
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestHomeWidgets(SimpleTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), StubWidgetsHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        base_url = f"http://127.0.0.1:{cls.server.server_port}"
+        cls.stub_settings = override_settings(
+            CAT_FACT_URL=f"{base_url}/fact",
+            DOG_IMAGE_URL=f"{base_url}/image",
+            HOME_WIDGETS_TIMEOUT=0.5,
+            HOME_WIDGETS_TTL=60,
+            HOME_WIDGETS_MAX_STALENESS=600,
+        )
+        cls.stub_settings.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.stub_settings.disable()
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.server.delay = 0
+        self.server.status = 200
+        self.server.fact = "Cats sleep a lot"
+        self.server.dog = "https://dogs.example/dog.jpg"
+        for widget in WIDGETS.values():
+            widget.reset()
+
+    def tearDown(self):
+        # Background refreshes must not outlive the stub server settings
+        pending = [widget._refreshing for widget in WIDGETS.values() if widget._refreshing]
+        for future in pending:
+            future.exception(timeout=5)
+
+    def wait_for_refresh(self):
+        for widget in WIDGETS.values():
+            widget.refresh().result(timeout=5)
+
+    def test_cold_cache_fetches_widgets(self):
+        widgets = get_home_widgets()
+        self.assertEqual(widgets, {"cat_fact": "Cats sleep a lot",
+                                   "dog_image_url": "https://dogs.example/dog.jpg"})
+
+    def test_slow_upstream_on_cold_cache_is_cut_off_by_deadline(self):
+        self.server.delay = 2
+
+        started = time.monotonic()
+        widgets = get_home_widgets()
+
+        self.assertLess(time.monotonic() - started, 1.5)
+        self.assertEqual(widgets, {"cat_fact": NO_CAT_FACT, "dog_image_url": NO_DOG_PICTURE})
+
+    def test_fresh_value_is_served_without_upstream(self):
+        get_home_widgets()
+        self.server.fact = "Changed fact"
+
+        self.assertEqual(get_home_widgets()["cat_fact"], "Cats sleep a lot")
+
+    def test_expired_value_is_served_and_refreshed_in_background(self):
+        get_home_widgets()
+        self.server.fact = "Changed fact"
+        self.server.delay = 0.3
+
+        with override_settings(HOME_WIDGETS_TTL=0):
+            started = time.monotonic()
+            self.assertEqual(get_home_widgets()["cat_fact"], "Cats sleep a lot")
+            self.assertLess(time.monotonic() - started, 0.2)
+            self.wait_for_refresh()
+
+        self.assertEqual(get_home_widgets()["cat_fact"], "Changed fact")
+
+    def test_last_good_value_survives_upstream_failure(self):
+        get_home_widgets()
+        self.server.status = 500
+
+        with override_settings(HOME_WIDGETS_TTL=0):
+            get_home_widgets()
+            self.wait_for_refresh()
+            self.assertEqual(get_home_widgets()["cat_fact"], "Cats sleep a lot")
+
+    def test_placeholder_after_max_staleness(self):
+        get_home_widgets()
+        self.server.status = 500
+
+        with override_settings(HOME_WIDGETS_TTL=0, HOME_WIDGETS_MAX_STALENESS=0):
+            self.assertEqual(get_home_widgets(), {"cat_fact": NO_CAT_FACT, "dog_image_url": NO_DOG_PICTURE})
@@ -1,6 +1,4 @@
 from django.urls import path
-from django.conf import settings
-from django.conf.urls.static import static
 from . import views
 
 
@@ -15,5 +13,8 @@ urlpatterns = [
     path('logout/', views.logout, name='logout'),
     path('login/', views.login, name='login'),
     path('profile/', views.profile, name='profile'),
-    path('statistics/', views.statistics, name='statistics')
-]+ static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
+    path('statistics/', views.statistics, name='statistics'),
+    path('statistics/api/', views.statistics_api, name='statistics-api'),
+    path('statistics/demographics/', views.demographics, name='statistics-demographics'),
+    path('statistics/deals/', views.deals_timeseries, name='statistics-deals')
+]
\ No newline at end of file
@@ -1,65 +1,45 @@
-import calendar
-import json
+import datetime
 import logging
 import pytz
-import requests
-from http import HTTPStatus
 from django.contrib.auth import login as auth_login, logout as auth_logout
 from django.contrib.auth.forms import AuthenticationForm
-from django.http import Http404
+from django.http import Http404, JsonResponse
 from django.shortcuts import render, redirect
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import etag
 from django.utils.timezone import now, localtime
 
 from .forms import CustomRegistrationForm
 from .models import AboutCompany, FAQ, PrivacyPolicy, Vacancy, Contacts
-from articles.models import Article
 from insurance_agency.models import Employee, UserProfile, Owner, Customer
 
-from .stats import get_deals_count, get_average_age, get_employees_stats, get_realty_stats
-from insurance_agency.models import Deal, Realty
+from .charts import employees_chart_url, realty_chart_url
+from .demographics import get_demographics
+from .fragments import home_fragments
+from .widgets import get_home_widgets
+from insurance_agency_back.query_budget import query_budget
+from insurance_agency import rollups, timeseries
+from insurance_agency.models import Deal
 
 logger = logging.getLogger(__name__)
 
 def home(request):
-    last_article = Article.objects.last()
-    if not last_article:
-        last_article = ""
-
     utc_now = now().astimezone(tz=pytz.utc)
     local_now = localtime(utc_now)
 
     logger.debug(f"UTC: {utc_now}")
     logger.debug(f"LOCAL: {local_now}")
 
-    cal = calendar.TextCalendar()
-    text_calendar = cal.formatmonth(local_now.year, local_now.month)
-
-    try:
-        response = requests.get("https://catfact.ninja/fact")
-        if response.status_code == HTTPStatus.OK:
-            response_body = json.loads(response.content)
-            cat_fact = response_body["fact"]
-        else:
-            logger.error("Unable to access cat-fact API")
-            cat_fact = "No cat fact ☹"
-    except Exception:
-        cat_fact = "No cat fact ☹"
-
-    try:
-        response = requests.get("https://dog.ceo/api/breeds/image/random")
-        data = response.json()
-        dog_image_url = data["message"]
-    except Exception:
-        dog_image_url = "No dog picture ☹"
-        logger.error("Unable to access dog-picture API")
+    fragments = home_fragments(local_now)
+    widgets = get_home_widgets()
 
     context = {
         "utc_now": utc_now.strftime("%d/%m/%Y %H:%M"),
         "local_now": local_now,
-        "text_calendar": text_calendar,
-        "article": last_article,
-        "cat_fact": cat_fact,
-        "dog_image_url": dog_image_url
+        "text_calendar": fragments["text_calendar"],
+        "article": fragments["article"],
+        "cat_fact": widgets["cat_fact"],
+        "dog_image_url": widgets["dog_image_url"]
     }
     return render(request, "site_manager/home.html",
     context)
@@ -79,8 +59,9 @@ def faq(request):
     {"faq": faq})
 
 
+@query_budget(queries=4)
 def contacts(request):
-    employees = Contacts.objects.all()
+    employees = Contacts.objects.for_listing()
     return render(request, 'site_manager/contacts.html',
                   {"contacts": employees})
 
@@ -145,15 +126,79 @@ def profile(request):
                             "customer": customer})
 
 
+def _average_ages(stats):
+    averages = {}
+    for role in rollups.ROLES:
+        average = rollups.average_age(stats, role)
+        averages[role] = round(average, 3) if average is not None else None
+    return averages
+
+
 def statistics(request):
-    get_employees_stats(Deal.objects.all())
-    get_realty_stats(Realty.objects.all())
+    stats = rollups.read()
+    averages = _average_ages(stats)
+
     context = {
-        "deals_count": get_deals_count(Deal.objects.all()),
-        "customers_average_age": round(get_average_age(Customer.objects.all()), 3),
-        "employees_average_age": round(get_average_age(Employee.objects.all()), 3),
-        "owners_average_age": round(get_average_age(Owner.objects.all()), 3),
-        "employees_stats_picture": "/media/stats/employees_sales_stats.png",
-        "realty_stats_picture": "/media/stats/realty_pie_chart.png"
+        "deals_count": rollups.deals_total_value(stats),
+        "customers_average_age": averages["customer"],
+        "employees_average_age": averages["employee"],
+        "owners_average_age": averages["owner"],
+        "employees_stats_picture": employees_chart_url(rollups.deals_per_employee(stats)),
+        "realty_stats_picture": realty_chart_url(rollups.realty_per_type(stats))
     }
     return render(request, 'site_manager/statistics.html', context)
+
+
+def statistics_etag(request):
+    rollups.ensure_built()
+    # Average ages also move when the year does
+    return f"{rollups.version()}-{datetime.date.today().year}"
+
+
+@cache_control(no_cache=True)
+@etag(statistics_etag)
+def statistics_api(request):
+    stats = rollups.read()
+    return JsonResponse({
+        "deals_total_value": rollups.deals_total_value(stats),
+        "average_age": _average_ages(stats),
+        "deals_per_employee": [{"employee": name, "deals": count}
+                               for name, count in rollups.deals_per_employee(stats)],
+        "realty_per_type": [{"type": name, "count": count}
+                            for name, count in rollups.realty_per_type(stats)],
+        "available_realty": rollups.available_realty(stats),
+        "available_per_type": [{"type": name, "count": count}
+                               for name, count in rollups.available_per_type(stats)],
+    })
+
+
+def demographics(request):
+    return JsonResponse(get_demographics())
+
+
+def deals_timeseries(request):
+    today = now().date()
+    try:
+        start = datetime.date.fromisoformat(request.GET.get("start") or (today - datetime.timedelta(days=30)).isoformat())
+        end = datetime.date.fromisoformat(request.GET.get("end") or today.isoformat())
+    except ValueError:
+        return JsonResponse({"error": "start and end must be dates in YYYY-MM-DD format"}, status=400)
+
+    bucket = request.GET.get("bucket", "day")
+    deal_type = request.GET.get("deal_type")
+    status = request.GET.get("status")
+    if bucket not in timeseries.BUCKETS:
+        return JsonResponse({"error": f"bucket must be one of: {', '.join(timeseries.BUCKETS)}"}, status=400)
+    if deal_type and deal_type not in Deal.DealType.values:
+        return JsonResponse({"error": f"Unknown deal type '{deal_type}'"}, status=400)
+    if status and status not in Deal.DealStatus.values:
+        return JsonResponse({"error": f"Unknown deal status '{status}'"}, status=400)
+
+    rollups.ensure_built()
+    rows = timeseries.series(start, end, bucket, deal_type, status)
+    return JsonResponse({
+        "start": start,
+        "end": end,
+        "bucket": bucket,
+        "series": rows,
+    })
@@ -0,0 +1,111 @@
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from http import HTTPStatus
+
+import requests
+from django.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+NO_CAT_FACT = "No cat fact ☹"
+NO_DOG_PICTURE = "No dog picture ☹"
+
+# Shared between requests so that a page view never pays for thread start-up.
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="home-widgets")
+
+
+class WidgetUnavailable(Exception):
+    pass
+
+
+def fetch_cat_fact(timeout):
+    response = requests.get(settings.CAT_FACT_URL, timeout=timeout)
+    if response.status_code != HTTPStatus.OK:
+        logger.error("Unable to access cat-fact API")
+        raise WidgetUnavailable(f"cat-fact API answered {response.status_code}")
+    return json.loads(response.content)["fact"]
+
+
+def fetch_dog_image_url(timeout):
+    response = requests.get(settings.DOG_IMAGE_URL, timeout=timeout)
+    return response.json()["message"]
+
+
+class WidgetCache:
+    """
+    Stale-while-revalidate cache for one third-party widget.
+
+    Reads never wait for the upstream: an expired value is returned as is
+    while a refresh runs in the background. If refreshes keep failing, the
+    last good value is served until it is older than
+    HOME_WIDGETS_MAX_STALENESS, then the placeholder is shown instead.
+    """
+
+    def __init__(self, name, fetcher, placeholder):
+        self.name = name
+        self.fetcher = fetcher
+        self.placeholder = placeholder
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self._value = None
+        self._fetched_at = None
+        self._refreshing = None
+
+    def age(self):
+        if self._fetched_at is None:
+            return None
+        return time.monotonic() - self._fetched_at
+
+    def refresh(self):
+        """Starts a background refresh unless one is already running."""
+        with self._lock:
+            if self._refreshing is None:
+                self._refreshing = _executor.submit(self._refresh)
+            return self._refreshing
+
+    def _refresh(self):
+        try:
+            value = self.fetcher(settings.HOME_WIDGETS_TIMEOUT)
+        except Exception as e:
+            logger.error(f"Unable to refresh home widget '{self.name}': {e}")
+            with self._lock:
+                self._refreshing = None
+            return
+
+        with self._lock:
+            self._value = value
+            self._fetched_at = time.monotonic()
+            self._refreshing = None
+
+    def get(self):
+        age = self.age()
+        if age is None or age >= settings.HOME_WIDGETS_TTL:
+            self.refresh()
+        if age is None or age > settings.HOME_WIDGETS_MAX_STALENESS:
+            return self.placeholder
+        return self._value
+
+
+WIDGETS = {
+    "cat_fact": WidgetCache("cat_fact", fetch_cat_fact, NO_CAT_FACT),
+    "dog_image_url": WidgetCache("dog_image_url", fetch_dog_image_url, NO_DOG_PICTURE),
+}
+
+
+def get_home_widgets():
+    """
+    Returns the cached value of every home page widget.
+
+    Only a cold cache (nothing fetched yet in this process) makes the caller
+    wait, and never longer than HOME_WIDGETS_TIMEOUT for all widgets together.
+    """
+    cold = [widget.refresh() for widget in WIDGETS.values() if widget.age() is None]
+    if cold:
+        wait(cold, timeout=settings.HOME_WIDGETS_TIMEOUT)
+    return {name: widget.get() for name, widget in WIDGETS.items()}